@@ -0,0 +1,258 @@
+import argparse
+import time
+
+import numpy as np
+
+from database import StockDataDB
+from fx import CurrencyConverter, FxStore
+from price_store import PriceStore
+from total_return import TotalReturnStore
+
+
+class Portfolio:
+    """
+    State of a simulated portfolio, all held in arrays over the asset columns of the price panel. It is everything
+    that carries over from one period to the next, so a simulation can be continued from it.
+    """
+
+    def __init__(self, n_assets: int):
+        self.shares = np.zeros(n_assets)
+        self.last_price = np.full(n_assets, np.nan)
+        self.cash = 0.0
+        self.invested = 0.0
+        self.costs = 0.0
+        self.periods = 0
+        '''periods simulated so far, keeps the rebalancing schedule aligned when a simulation is continued'''
+
+    def value(self, prices: np.ndarray) -> float:
+        """Holdings plus cash, assets without a price (e.g. in a gap) at the last price they had."""
+        prices = np.where(np.isnan(prices), self.last_price, prices)
+        return float(np.dot(self.shares, np.nan_to_num(prices))) + self.cash
+
+
+class BacktestResult:
+    def __init__(self, values: np.ndarray, invested: np.ndarray, costs: np.ndarray, portfolio: Portfolio):
+        self.values = values
+        '''portfolio value (holdings plus cash) at the close of every period'''
+        self.invested = invested
+        '''cumulative contributions up to every period'''
+        self.costs = costs
+        '''cumulative transaction costs up to every period'''
+        self.portfolio = portfolio
+
+    @property
+    def final_value(self) -> float:
+        return float(self.values[-1])
+
+    @property
+    def total_invested(self) -> float:
+        return float(self.invested[-1])
+
+
+def lump_sum(n_periods: int, amount: float) -> np.ndarray:
+    """Contribution schedule investing ``amount`` once, in the first period."""
+    contributions = np.zeros(n_periods)
+    contributions[0] = amount
+    return contributions
+
+
+def periodic(n_periods: int, amount: float, every: int = 1) -> np.ndarray:
+    """Contribution schedule investing ``amount`` every ``every`` periods, e.g. monthly DCA on monthly candles."""
+    contributions = np.zeros(n_periods)
+    contributions[::every] = amount
+    return contributions
+
+
+def weekly(dates: np.ndarray, amount: float, weekday: int = 0) -> np.ndarray:
+    """
+    Contribution schedule investing ``amount`` once a week on daily candles: on ``weekday`` (0 is Monday), or the
+    first trading day after it when the market is closed, skipping weeks without one.
+    """
+    days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    # 1970-01-01 was a Thursday
+    weekdays = (days + 3) % 7
+    weeks = (days + 3) // 7
+    eligible = np.flatnonzero(weekdays >= weekday)
+    first_of_week = eligible[np.r_[True, weeks[eligible][1:] != weeks[eligible][:-1]]] if len(eligible) else eligible
+    contributions = np.zeros(len(days))
+    contributions[first_of_week] = amount
+    return contributions
+
+
+def market_caps(database: StockDataDB, dates: np.ndarray, isins: list[str]) -> np.ndarray:
+    """
+    ``dates x isins`` market capitalisations from the ABSOLUTES snapshots as of every date, NaN where an ISIN has no
+    snapshot yet. Only one cross-section query is run per distinct date.
+    """
+    caps = np.full((len(dates), len(isins)), np.nan)
+    for row, date in enumerate(np.asarray(dates, dtype="datetime64[D]")):
+        cross_section = database.get_absolutes_as_of(str(date), isins)
+        caps[row] = cross_section["marketCap"].reindex(isins).to_numpy()
+    return caps
+
+
+def _target_weights(weighting: str | np.ndarray, valid: np.ndarray, caps: np.ndarray | None) -> np.ndarray:
+    if isinstance(weighting, str):
+        if weighting == "equal":
+            weights = valid.astype(np.float64)
+        elif weighting == "market_cap":
+            weights = np.where(valid, np.nan_to_num(caps), 0.0)
+        else:
+            raise ValueError(f"Unknown weighting: {weighting}")
+    else:
+        weights = np.where(valid, weighting, 0.0)
+    total = weights.sum()
+    return weights / total if total > 0 else weights
+
+
+def backtest(prices: np.ndarray, contributions: np.ndarray, weighting: str | np.ndarray = "equal",
+             rebalance_every: int = 0, cost: float = 0.0, caps: np.ndarray | None = None,
+             portfolio: Portfolio | None = None, listing_end: np.ndarray | None = None) -> BacktestResult:
+    """
+    Simulate a passive strategy over ``prices`` (periods x assets, NaN where an asset can't be traded).
+
+    Every period, the contribution of that period is added to the cash and invested according to the target
+    weights. On rebalancing periods, the whole portfolio is traded back to the target weights instead. Holdings of
+    assets that stop trading for good are sold at their last price, during a gap they are kept and valued at it.
+    Time is the only Python loop, every period is a handful of array operations over all assets.
+
+    :param contributions: cash added in every period, see :func:`lump_sum` and :func:`periodic`
+    :param weighting: "equal", "market_cap" (requires ``caps``) or fixed weights per asset
+    :param rebalance_every: rebalance every this many periods, 0 never rebalances
+    :param cost: transaction costs as a fraction of the traded value
+    :param caps: market capitalisations, periods x assets (see :func:`market_caps`) or one value per asset
+    :param portfolio: state to continue from, a new empty portfolio when None
+    :param listing_end: per asset, the period (counted like ``portfolio.periods``) after its last price, from
+        which it is delisted (see :meth:`PricePanel.listing_range`). Taken from ``prices`` when None, which is only
+        right when they reach to the end of the data.
+    """
+    market_cap = isinstance(weighting, str) and weighting == "market_cap"
+    if market_cap and caps is None:
+        raise ValueError("Market cap weighting needs market caps")
+    n_periods, n_assets = prices.shape
+    if portfolio is None:
+        portfolio = Portfolio(n_assets)
+    if listing_end is None:
+        has_price = ~np.isnan(prices)
+        last = np.where(has_price.any(axis=0), n_periods - has_price[::-1].argmax(axis=0), 0)
+        listing_end = portfolio.periods + last
+    values = np.empty(n_periods)
+    invested = np.empty(n_periods)
+    costs = np.empty(n_periods)
+
+    for t in range(n_periods):
+        price = prices[t]
+        valid = ~np.isnan(price)
+
+        delisted = (listing_end <= portfolio.periods) & (portfolio.shares != 0)
+        if delisted.any():
+            portfolio.cash += float(np.dot(portfolio.shares[delisted], portfolio.last_price[delisted]))
+            portfolio.shares[delisted] = 0.0
+        portfolio.last_price[valid] = price[valid]
+
+        portfolio.cash += contributions[t]
+        portfolio.invested += contributions[t]
+
+        period = portfolio.periods
+        rebalance = rebalance_every > 0 and period % rebalance_every == 0
+        if rebalance or portfolio.cash > 0:
+            weights = _target_weights(weighting, valid, None if caps is None else caps[t] if caps.ndim == 2 else caps)
+            if market_cap and valid.any() and not weights.any():
+                raise ValueError(f"No market caps for any asset with a price in period {period}")
+            safe_price = np.where(valid, price, 1.0)
+            holdings = portfolio.shares * np.where(valid, price, 0.0)
+            if rebalance:
+                total = holdings.sum() + portfolio.cash
+                trades = weights * total - holdings
+                # Pay the costs out of the rebalanced value, one fixed point step is exact enough for small costs
+                trades = weights * (total - cost * np.abs(trades).sum()) - holdings
+            else:
+                trades = weights * portfolio.cash / (1 + cost)
+            trade_costs = cost * float(np.abs(trades).sum())
+            portfolio.shares += trades / safe_price
+            portfolio.cash -= float(trades.sum()) + trade_costs
+            portfolio.costs += trade_costs
+
+        portfolio.periods += 1
+        values[t] = portfolio.value(price)
+        invested[t] = portfolio.invested
+        costs[t] = portfolio.costs
+
+    return BacktestResult(values, invested, costs, portfolio)
+
+
+def backtest_streaming(store: PriceStore, contributions: np.ndarray, weighting: str | np.ndarray = "equal",
+                       rebalance_every: int = 0, cost: float = 0.0, caps_path: str | None = None,
+                       field: str = "Close", memory_limit: int = 256 << 20,
+                       portfolio: Portfolio | None = None) -> BacktestResult:
+    """
+    :func:`backtest` over a stored panel too large for memory, e.g. decades of daily candles. Time is walked in
+    chunks of rows read from the store, only the :class:`Portfolio` carries over from one chunk to the next, and
+    the chunks are sized to keep the prices, market caps and per-period temporaries under ``memory_limit`` bytes.
+    The result is identical to a single :func:`backtest` over the whole panel.
+
+    :param caps_path: ``.npy`` file with market caps aligned to the store, for market cap weighting
+    :param field: price field to trade at, e.g. "Total Return" when a total return index was built
+    """
+    panel = store.load()
+    n_periods, n_assets = panel.shape
+    # A chunk of prices and one of caps, plus about as much again for what the simulation derives from them
+    chunk_rows = max(1, memory_limit // (4 * 8 * n_assets))
+    portfolio = portfolio if portfolio is not None else Portfolio(n_assets)
+    # Whether a missing price is a gap or a delisting depends on rows the chunk doesn't hold
+    listing_end = portfolio.periods + panel.listing_range()[1]
+    values = np.empty(n_periods)
+    invested = np.empty(n_periods)
+    costs = np.empty(n_periods)
+    for start in range(0, n_periods, chunk_rows):
+        stop = min(start + chunk_rows, n_periods)
+        caps = None
+        if caps_path is not None:
+            caps = np.load(caps_path, mmap_mode='r')
+            caps = np.array(caps[start:stop] if caps.ndim == 2 else caps)
+        result = backtest(store.rows(field, start, stop), contributions[start:stop], weighting, rebalance_every,
+                          cost, caps, portfolio, listing_end)
+        values[start:stop] = result.values
+        invested[start:stop] = result.invested
+        costs[start:stop] = result.costs
+    return BacktestResult(values, invested, costs, portfolio)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DCA into an equal-weight portfolio of the stored universe")
+    parser.add_argument("--store", default="/home/ruben/Projects/finfacts/cache/panel-int_1mo")
+    parser.add_argument("--amount", type=float, default=100.0)
+    parser.add_argument("--rebalance", type=int, default=12)
+    parser.add_argument("--cost", type=float, default=0.001)
+    parser.add_argument("--total-return", action="store_true",
+                        help="reinvest dividends, using the total return index built by total_return.py")
+    parser.add_argument("--weekday", type=int, help="on daily candles, contribute weekly on this day (0 is Monday)")
+    parser.add_argument("--memory-limit", type=int, help="stream the store in chunks using at most this many MB")
+    parser.add_argument("--currency", help="convert all prices to this currency first, e.g. EUR")
+    parser.add_argument("--fx", default="/home/ruben/Projects/finfacts/cache/fx-int_1mo",
+                        help="FX store filled by fx.py")
+    args = parser.parse_args()
+    if args.currency and args.memory_limit:
+        parser.error("--currency converts the whole panel in memory, it can't be combined with --memory-limit")
+
+    store = PriceStore(args.store)
+    panel = store.load()
+    if args.total_return:
+        TotalReturnStore(store).attach(panel)
+    if args.currency:
+        database = StockDataDB()
+        panel = CurrencyConverter(panel, database.get_currencies(), FxStore(args.fx)).convert(args.currency)
+        database.connection.close()
+    start = time.perf_counter()
+    field = TotalReturnStore.FIELD if args.total_return else "Close"
+    if args.weekday is not None:
+        schedule = weekly(panel.dates, args.amount, args.weekday)
+    else:
+        schedule = periodic(len(panel.dates), args.amount)
+    if args.memory_limit:
+        result = backtest_streaming(store, schedule, "equal", args.rebalance, args.cost, field=field,
+                                    memory_limit=args.memory_limit << 20)
+    else:
+        result = backtest(panel[field], schedule, "equal", args.rebalance, args.cost)
+    print(f"Invested {result.total_invested:.2f}, worth {result.final_value:.2f} on {panel.dates[-1]} "
+          f"({len(panel.dates)} periods x {len(panel.isins)} ISINs in {time.perf_counter() - start:.3f}s)")
@@ -0,0 +1,367 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable
+
+import numpy as np
+
+import metrics
+from backtest import backtest, backtest_streaming, periodic, weekly
+from beursrally.assets import BeursrallyAssets
+from data_source import SyntheticDataSource
+from database import StockDataDB
+from fx import CurrencyConverter, FxStore
+from pipeline import MetadataPipeline
+from price_store import PricePanel, PriceStore
+from result_cache import ResultCache
+from screener import Screener
+from total_return import TotalReturnStore
+from stock_metadata import StockMetadata
+
+Setup = Callable[..., tuple[Callable[[], object], int]]
+'''called with a scratch directory and the benchmark parameters, returns the function to time and the number of
+items (rows, lookups, ISINs, ...) one call of it processes'''
+
+BENCHMARKS: list[tuple[str, Setup, dict]] = []
+
+SNAPSHOT_DATE = "2024-06-28"
+'''date of the synthetic snapshots, fixed so every run writes the same rows whatever day it runs on'''
+
+
+def benchmark(**parameters):
+    """Register a benchmark once for every combination of the listed parameter values."""
+    def register(setup: Setup) -> Setup:
+        for values in itertools.product(*parameters.values()):
+            kwargs = dict(zip(parameters, values))
+            name = setup.__name__ + "".join(f"[{key}={value}]" for key, value in kwargs.items())
+            BENCHMARKS.append((name, setup, kwargs))
+        return setup
+    return register
+
+
+def synthetic_universe(n_isins: int, seed: int = 0) -> list[dict]:
+    """Fake ISINs with the same shape of data ``StockMetadata.store_metadata`` writes for a real one."""
+    rng = random.Random(seed)
+    universe = []
+    for i in range(n_isins):
+        isin = f"XX{i:010d}"
+        universe.append({
+            'meta': (isin, f"SYM{i}", f"Synthetic {i}", "EUR", "AMS", "2000-01-01"),
+            'absolutes': (isin, SNAPSHOT_DATE, rng.randrange(10 ** 9), rng.randrange(10 ** 9),
+                          rng.randrange(10 ** 6), rng.randrange(10 ** 6)),
+            'ratios': (isin, SNAPSHOT_DATE, *(rng.random() * 20 for _ in range(8))),
+            'events': [(isin, f"{SNAPSHOT_DATE[:4]}-{month:02d}-{rng.randrange(1, 29):02d}", "Earnings")
+                       for month in (1, 4, 7)]
+        })
+    return universe
+
+
+def _store(database: StockDataDB, universe: list[dict]) -> int:
+    rows = 0
+    for item in universe:
+        database.add_metadata(*item['meta'])
+        database.add_absolutes(*item['absolutes'])
+        database.add_ratios(*item['ratios'])
+        for event in item['events']:
+            database.add_event(*event)
+        rows += 3 + len(item['events'])
+    return rows
+
+
+def _snapshot_database(directory: str, isins: int, days: int) -> tuple[StockDataDB, list[str], list[str]]:
+    database = StockDataDB(path=os.path.join(directory, "snapshots.db"), wal=True, synchronous="NORMAL")
+    rng = random.Random(0)
+    isin_list = [f"XX{i:010d}" for i in range(isins)]
+    dates = [str(day) for day in np.arange("2020-01-01", "2030-01-01", dtype="datetime64[D]")[:days]]
+    with database.batch():
+        for date in dates:
+            for isin in isin_list:
+                database.add_absolutes(isin, date, rng.randrange(10 ** 9), None, rng.randrange(10 ** 6), None)
+                database.add_ratios(isin, date, *(rng.random() * 20 for _ in range(8)))
+    return database, isin_list, dates
+
+
+# At 10k ISINs as well, to compare with the batched inserts
+@benchmark(isins=[1000, 10_000])
+def inserts_row_by_row(directory: str, isins: int):
+    universe = synthetic_universe(isins)
+    runs = itertools.count()
+
+    def run():
+        database = StockDataDB(path=os.path.join(directory, f"row_by_row-{next(runs)}.db"))
+        _store(database, universe)
+        database.connection.close()
+    return run, 6 * isins
+
+
+@benchmark(isins=[1000, 10_000])
+def inserts_batched(directory: str, isins: int):
+    universe = synthetic_universe(isins)
+    runs = itertools.count()
+
+    def run():
+        database = StockDataDB(path=os.path.join(directory, f"batched-{next(runs)}.db"), wal=True,
+                               synchronous="NORMAL")
+        with database.batch():
+            _store(database, universe)
+        database.connection.close()
+    return run, 6 * isins
+
+
+@benchmark(events=[10_000, 100_000, 1_000_000])
+def events_in_order(directory: str, events: int):
+    database = StockDataDB(path=os.path.join(directory, "events.db"), wal=True, synchronous="NORMAL")
+    rng = random.Random(0)
+    days = np.arange("2000-01-01", "2030-01-01", dtype="datetime64[D]")
+    with database.batch():
+        for i in range(events):
+            database.add_event(f"XX{i % 5000:010d}", str(days[rng.randrange(len(days))]), "Earnings")
+    return database.get_events_in_order, events
+
+
+@benchmark(isins=[1000], days=[250])
+def snapshot_lookups(directory: str, isins: int, days: int):
+    database, isin_list, dates = _snapshot_database(directory, isins, days)
+    rng = random.Random(1)
+    lookups = [(rng.choice(isin_list), rng.choice(dates)) for _ in range(1000)]
+
+    def run():
+        for isin, date in lookups:
+            database.get_absolutes(isin, date)
+            database.get_ratios(isin, date)
+    return run, 2 * len(lookups)
+
+
+@benchmark(isins=[1000], days=[250])
+def snapshot_cross_sections(directory: str, isins: int, days: int):
+    database, isin_list, dates = _snapshot_database(directory, isins, days)
+    rebalance_dates = dates[::21]
+
+    def run():
+        for date in rebalance_dates:
+            database.get_absolutes_as_of(date)
+            database.get_ratios_as_of(date)
+    return run, 2 * len(rebalance_dates)
+
+
+@benchmark(isins=[1000], days=[250])
+def screener_rebalance(directory: str, isins: int, days: int):
+    database, _, dates = _snapshot_database(directory, isins, days)
+    rebalance_dates = dates[::21]
+
+    def run():
+        # A new screener every run, so the cross-sections are read from the database rather than the cache
+        Screener(database).rebalance_schedule(rebalance_dates, [("trailingPE", "<", 15), ("beta", "<", 10)],
+                                              rank_by="marketCap", top=50)
+    return run, len(rebalance_dates)
+
+
+@benchmark(calls=[100])
+def asset_universe(directory: str, calls: int):
+    def run():
+        for _ in range(calls):
+            BeursrallyAssets.stock_isins()
+            BeursrallyAssets.fund_isins()
+            BeursrallyAssets.etf_isins()
+    return run, 3 * calls
+
+
+@benchmark(isins=[500], latency=[0.005])
+def ingestion_serial(directory: str, isins: int, latency: float):
+    source = SyntheticDataSource(isins, latency=latency)
+    os.chdir(directory)
+
+    def run():
+        stock_metadata = StockMetadata(data_source=source)
+        for isin in source.isins():
+            stock_metadata.store_metadata(isin)
+    return run, isins
+
+
+@benchmark(isins=[500], latency=[0.005], concurrency=[1, 8])
+def ingestion_pipeline(directory: str, isins: int, latency: float, concurrency: int):
+    source = SyntheticDataSource(isins, latency=latency)
+
+    def run():
+        pipeline = MetadataPipeline(StockMetadata(data_source=source), os.path.join(directory, "pipeline.db"),
+                                    concurrency=concurrency)
+        pipeline.run(source.isins())
+    return run, isins
+
+
+def _synthetic_panel(isins: int, periods: int) -> PricePanel:
+    rng = np.random.default_rng(0)
+    close = 10 * np.exp(np.cumsum(rng.normal(0.005, 0.05, (periods, isins)), axis=0))
+    close[:rng.integers(periods), rng.integers(isins, size=isins // 5)] = np.nan
+    fields = {field: close for field in PricePanel.FIELDS}
+    dates = np.arange("1990-01", "2100-01", dtype="datetime64[M]")[:periods].astype("datetime64[D]")
+    return PricePanel(dates, [f"XX{i:010d}" for i in range(isins)], fields)
+
+
+@benchmark(isins=[1000], periods=[360])
+def price_store_load(directory: str, isins: int, periods: int):
+    store = PriceStore(os.path.join(directory, "panel"))
+    store.save(_synthetic_panel(isins, periods))
+
+    def run():
+        panel = store.load()
+        return float(np.nansum(panel["Close"][-1]))
+    return run, isins
+
+
+@benchmark(isins=[1000], periods=[360], changed=[1000, 10])
+def total_return_rebuild(directory: str, isins: int, periods: int, changed: int):
+    store = PriceStore(os.path.join(directory, "panel"))
+    panel = _synthetic_panel(isins, periods)
+    panel.fields["Dividends"] = np.zeros(panel.shape)
+    store.save(panel)
+    total_return = TotalReturnStore(store)
+    total_return.build(panel)
+    runs = itertools.count(1)
+
+    def run():
+        # Touch the last candle of ``changed`` ISINs, so only those need a rebuild
+        panel["Close"][-1, :changed] *= 1 + next(runs) * 1e-6
+        total_return.build(panel)
+    return run, isins
+
+
+@benchmark(isins=[1000], periods=[360])
+def currency_conversion(directory: str, isins: int, periods: int):
+    panel = _synthetic_panel(isins, periods)
+    fx_store = FxStore(os.path.join(directory, "fx"))
+    fx_store.update(["USD", "GBP", "CHF"], SyntheticDataSource(first_date="1990-01-01"))
+    currencies = dict(zip(panel.isins, itertools.cycle(["EUR", "USD", "GBp", "CHF"])))
+
+    def run():
+        # A new converter every run, so nothing comes from its memo
+        CurrencyConverter(panel, currencies, fx_store).convert("EUR")
+    return run, isins
+
+
+@benchmark(isins=[5000], periods=[360])
+def metrics_summary(directory: str, isins: int, periods: int):
+    values = _synthetic_panel(isins, periods)["Close"]
+    return lambda: metrics.summary(values).sort_values("sharpe"), isins
+
+
+@benchmark(isins=[500], periods=[360])
+def backtest_monthly_dca(directory: str, isins: int, periods: int):
+    prices = _synthetic_panel(isins, periods)["Close"]
+    contributions = periodic(periods, 100.0)
+    return lambda: backtest(prices, contributions, "equal", 12, 0.001), periods
+
+
+@benchmark(entries=[1000])
+def result_cache_hits(directory: str, entries: int):
+    cache = ResultCache(directory, "source", "fingerprint")
+    grid = [{'start': start, 'horizon': 120, 'weighting': "equal"} for start in range(entries)]
+    for params in grid:
+        cache.put(params, {'values': np.linspace(100.0, 200.0, 120)})
+
+    def run():
+        for params in grid:
+            cache.get(params)
+    return run, entries
+
+
+@benchmark(isins=[2000], periods=[2520], memory_mb=[16])
+def backtest_streaming_daily(directory: str, isins: int, periods: int, memory_mb: int):
+    store = PriceStore(os.path.join(directory, "daily"))
+    rng = np.random.default_rng(0)
+    dates = np.busday_offset("2000-01-03", np.arange(periods), roll="forward")
+    with store.writer(dates, [f"XX{i:010d}" for i in range(isins)]) as panel:
+        for start in range(0, periods, 252):
+            stop = min(start + 252, periods)
+            panel["Close"][start:stop] = 10 * np.exp(rng.normal(0.0003, 0.013, (stop - start, isins)).cumsum(axis=0))
+    contributions = weekly(dates, 25.0, weekday=2)
+    return lambda: backtest_streaming(store, contributions, "equal", 0, 0.001, memory_limit=memory_mb << 20), periods
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(selection: str | None = None, repeat: int = 3) -> list[dict]:
+    results = []
+    working_directory = os.getcwd()
+    for name, setup, kwargs in BENCHMARKS:
+        if selection is not None and selection not in name:
+            continue
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    run, items = setup(directory, **kwargs)
+                    times = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        run()
+                        times.append(time.perf_counter() - start)
+            except FileNotFoundError as e:
+                print(f"{name:60s} skipped: {e}")
+                continue
+            finally:
+                os.chdir(working_directory)
+        result = {
+            'name': name,
+            'parameters': kwargs,
+            'items': items,
+            'times': times,
+            'best': min(times),
+            'median': statistics.median(times),
+            'items_per_second': items / min(times)
+        }
+        results.append(result)
+        print(f"{name:60s} best {result['best']:9.4f}s  median {result['median']:9.4f}s  "
+              f"{result['items_per_second']:12.0f} items/s")
+    return results
+
+
+def compare(results: list[dict], baseline_path: str):
+    with open(baseline_path, 'r') as file:
+        baseline = {result['name']: result for result in json.load(file)['results']}
+    print(f"Compared to {baseline_path} (>1 is faster):")
+    for result in results:
+        if result['name'] in baseline:
+            speedup = baseline[result['name']]['best'] / result['best']
+            print(f"  {result['name']:60s} {speedup:6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion, storage and simulation hot paths")
+    parser.add_argument("-k", dest="selection", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="results file, bench_results/<commit>.json by default")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    commit = _commit()
+    benchmark_results = run_benchmarks(args.selection, args.repeat)
+    output = args.output or os.path.join("bench_results", f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w') as results_file:
+        # noinspection PyTypeChecker
+        json.dump({
+            'commit': commit,
+            'timestamp': datetime.now().isoformat(timespec="seconds"),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': benchmark_results
+        }, results_file, indent=4)
+    print(f"Saved results to {output}")
+    if args.compare:
+        compare(benchmark_results, args.compare)
@@ -1,8 +1,79 @@
+import argparse
+import json
+import os
+from datetime import datetime
+
+import history
 from beursrally.assets import BeursrallyAssets
+from database import StockDataDB
+from instrumentation import Instrumentation
+from pipeline import MetadataPipeline
+from refresh import CheckpointJournal, RefreshPlanner
 from stock_metadata import StockMetadata
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store metadata for every Beursrally stock")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of concurrent fetch workers")
+    parser.add_argument("--max-age", type=int, default=0,
+                        help="skip ISINs with a snapshot at most this many days old")
+    parser.add_argument("--journal", default="beursrally.journal",
+                        help="checkpoint journal used to resume an interrupted run")
+    parser.add_argument("--full", action="store_true", help="refresh every ISIN, fresh or not")
+    parser.add_argument("--delta", action="store_true",
+                        help="only store absolutes and ratios snapshots whose values changed since the last one")
+    parser.add_argument("--stats", help="write the per-stage timings and counters of the run to this JSON file")
+    parser.add_argument("--refresh-universe", action="store_true",
+                        help="download the Beursrally universe again and only ingest the stocks that were added, "
+                             "renamed or re-ticked, marking the removed ones as delisted. Changes of an earlier "
+                             "refresh that weren't ingested completely are carried over")
+    parser.add_argument("--from-diff", action="store_true",
+                        help="like --refresh-universe, but with the last saved diff, e.g. to resume an interrupted run")
+    parser.add_argument("--history", nargs="*", default=["1mo"], choices=history.INTERVALS,
+                        help="candle intervals to update for the changed stocks of a universe refresh")
+    args = parser.parse_args()
+
     beursrally_stocks = BeursrallyAssets.stock_isins()
-    stock_metadata = StockMetadata()
-    for isin in beursrally_stocks:
-        stock_metadata.store_metadata(isin)
\ No newline at end of file
+    target_date = datetime.today()
+    journal = CheckpointJournal(args.journal, target_date)
+    universe_diff = None
+    if args.refresh_universe or args.from_diff:
+        if args.refresh_universe:
+            universe_diff = BeursrallyAssets.save_and_filter_data()
+        else:
+            with open(BeursrallyAssets.diff_path(), 'r') as diff_file:
+                universe_diff = json.load(diff_file)
+        changed_stocks = BeursrallyAssets.changed_isins(universe_diff, BeursrallyAssets.STOCKS)
+        done = journal.done()
+        beursrally_stocks = [isin for isin in changed_stocks if isin not in done]
+        database = StockDataDB()
+        database.mark_delisted(universe_diff['delisted'], universe_diff['date'])
+        database.connection.close()
+        print(f"Universe diff of {universe_diff['date']}: {len(beursrally_stocks)}/{len(changed_stocks)} changed "
+              f"stocks left to ingest, {len(universe_diff['delisted'])} ISINs delisted")
+    elif not args.full:
+        database = StockDataDB()
+        beursrally_stocks = RefreshPlanner(database, args.max_age, journal).plan(beursrally_stocks, target_date)
+        database.connection.close()
+    instrumentation = Instrumentation()
+    MetadataPipeline(StockMetadata(instrumentation=instrumentation), concurrency=args.concurrency,
+                     journal=journal, delta=args.delta).run(beursrally_stocks)
+    if universe_diff is not None:
+        ingested = set(changed_stocks) <= journal.done()
+        for interval in args.history:
+            # Candles have a journal of their own, per diff, as the metadata journal says nothing about them
+            history_journal = CheckpointJournal(f"{os.path.splitext(args.journal)[0]}-history-{interval}.journal",
+                                                universe_diff['date'])
+            updated = history_journal.done()
+            for stock in changed_stocks:
+                if stock in updated:
+                    continue
+                if history.update_candles(stock, interval):
+                    history_journal.mark_done([stock])
+                else:
+                    ingested = False
+        if ingested:
+            BeursrallyAssets.mark_diff_ingested(universe_diff)
+        else:
+            print("Not every change was ingested, finish them with --from-diff")
+    if args.stats:
+        instrumentation.dump(args.stats)
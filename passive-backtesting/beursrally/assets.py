@@ -1,3 +1,6 @@
+import os
+from datetime import datetime
+
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -7,59 +10,227 @@ import json
 class BeursrallyAssets:
     DATA_URL = "https://beursrally-game.tijd.be/service/Game/SearchApi/GetSearchAssets"
 
+    STOCKS = "Aandelen"
+    FUNDS = "Beleggingsfondsen"
+    ETFS = "ETF"
+
+    data_directory = os.path.dirname(os.path.abspath(__file__))
+    '''where assets.json, assets_raw.json and cookies.json are read and written'''
+
+    excluded_isins: set[str] = {"BE0974380124", "BE0974386188", "FR0013447729", "NL0013654809", "NL00150002Q7"}
+    '''left out of the ISIN lists, e.g. because Yahoo Finance has no data for them'''
+
+    _index: dict | None = None
+    _index_key: tuple | None = None
+
+    @classmethod
+    def data_path(cls) -> str:
+        return os.path.join(cls.data_directory, 'assets.json')
+
     @classmethod
     def stock_isins(cls) -> list[str]:
-        data = cls._load_data()
-        res = list(data["Aandelen"].keys())
-        res.remove("BE0974380124")
-        res.remove("BE0974386188")
-        res.remove("FR0013447729")
-        res.remove("NL0013654809")
-        res.remove("NL00150002Q7")
-        return res
+        return list(cls._universe()['isins'].get(cls.STOCKS, ()))
 
     @classmethod
     def fund_isins(cls) -> list[str]:
-        data = cls._load_data()
-        return list(data["Beleggingsfondsen"].keys())
+        return list(cls._universe()['isins'].get(cls.FUNDS, ()))
 
     @classmethod
     def etf_isins(cls) -> list[str]:
-        data = cls._load_data()
-        return list(data["ETF"].keys())
+        return list(cls._universe()['isins'].get(cls.ETFS, ()))
+
+    @classmethod
+    def isins(cls, asset_class: str) -> list[str]:
+        """ISINs of ``asset_class`` (e.g. :attr:`STOCKS`) without the excluded ones."""
+        return list(cls._universe()['isins'].get(asset_class, ()))
+
+    @classmethod
+    def asset(cls, isin: str) -> dict[str, str] | None:
+        """Name, Ticker and AssetClass of ``isin`` (excluded or not), None when it isn't in the universe."""
+        return cls._universe()['by_isin'].get(isin)
+
+    @classmethod
+    def isins_for_ticker(cls, ticker: str) -> list[str]:
+        """Tickers aren't unique across exchanges, so this returns every ISIN trading under ``ticker``."""
+        return list(cls._universe()['by_ticker'].get(ticker, ()))
+
+    @classmethod
+    def _universe(cls) -> dict:
+        """
+        The parsed and indexed universe, only rebuilt when assets.json (its path or modification time) or the
+        exclusions changed since the last call.
+        """
+        path = cls.data_path()
+        key = (path, os.stat(path).st_mtime_ns, frozenset(cls.excluded_isins))
+        if cls._index_key != key:
+            cls._index = cls._build_index(cls._load_data(), cls.excluded_isins)
+            cls._index_key = key
+        return cls._index
+
+    @classmethod
+    def _build_index(cls, data: dict[str, dict[str, dict[str, str]]], excluded: set[str]) -> dict:
+        isins, by_isin, by_ticker = {}, {}, {}
+        for asset_class, assets in data.items():
+            isins[asset_class] = tuple(isin for isin in assets if isin not in excluded)
+            for isin, asset in assets.items():
+                by_isin[isin] = dict(asset, AssetClass=asset_class)
+                by_ticker.setdefault(asset["Ticker"], []).append(isin)
+        return {'isins': isins, 'by_isin': by_isin, 'by_ticker': {ticker: tuple(isins_with_ticker)
+                                                                 for ticker, isins_with_ticker in by_ticker.items()}}
 
     @classmethod
     def _load_data(cls) -> dict[str, dict[str, dict[str, str]]]:
-        with open('/home/ruben/Projects/finfacts/passive-backtesting/beursrally/assets.json', 'r') as file:
+        with open(cls.data_path(), 'r') as file:
             data = json.load(file)
         return data
 
     @classmethod
-    def save_and_filter_data(cls):
-        cls._get_assets_raw()
-        cls._filter_assets()
+    def diff_path(cls) -> str:
+        return os.path.join(cls.data_directory, 'assets_diff.json')
+
+    @classmethod
+    def save_and_filter_data(cls, data_source=None) -> dict:
+        """
+        Download the universe again and return how it changed, see :meth:`diff`. The diff is saved to
+        assets_diff.json as well, and assets.json is only rewritten when something changed. When the saved diff
+        wasn't ingested completely yet (see :meth:`mark_diff_ingested`), its changes are merged into the new one
+        instead of being replaced.
+
+        :param data_source: ``DataSource`` to get the raw asset list from, the Beursrally API when None
+        """
+        previous = cls._load_data() if os.path.exists(cls.data_path()) else {}
+        cls._get_assets_raw(data_source)
+        assets = cls._filter_assets()
+        diff = cls.diff(previous, assets)
+        pending = cls.pending_diff()
+        if pending is not None:
+            print(f"Merging the changes of {pending['date']} that weren't ingested yet into the new diff")
+            diff = cls.merge_diffs(pending, diff)
+        if assets != previous:
+            with open(cls.data_path(), 'w+') as file:
+                # noinspection PyTypeChecker
+                json.dump(assets, file, indent=4)
+        cls._save_diff(diff)
+        return diff
+
+    @classmethod
+    def _save_diff(cls, diff: dict):
+        with open(cls.diff_path(), 'w+') as file:
+            # noinspection PyTypeChecker
+            json.dump(diff, file, indent=4)
+
+    @classmethod
+    def pending_diff(cls) -> dict | None:
+        """The saved diff, unless it was ingested completely (or predates that being tracked)."""
+        if not os.path.exists(cls.diff_path()):
+            return None
+        with open(cls.diff_path(), 'r') as file:
+            diff = json.load(file)
+        return None if diff.get('ingested', True) else diff
+
+    @classmethod
+    def mark_diff_ingested(cls, diff: dict):
+        """Record that every change in ``diff`` was ingested, so the next refresh doesn't carry it over."""
+        cls._save_diff(dict(diff, ingested=True))
+
+    @classmethod
+    def diff(cls, previous: dict[str, dict[str, dict[str, str]]],
+             current: dict[str, dict[str, dict[str, str]]]) -> dict:
+        """
+        Per asset class, the ISINs that were ``added`` or ``removed`` and those whose Name or Ticker changed
+        (``renamed`` and ``reticked``, ISIN -> [old, new]), plus the ``delisted`` ISINs that left the universe
+        altogether rather than moving to another asset class, and whether the changes were ``ingested`` yet.
+        """
+        classes = {}
+        for asset_class in sorted(set(previous) | set(current)):
+            old, new = previous.get(asset_class, {}), current.get(asset_class, {})
+            kept = sorted(set(old) & set(new))
+            classes[asset_class] = {
+                'added': sorted(set(new) - set(old)),
+                'removed': sorted(set(old) - set(new)),
+                'renamed': {isin: [old[isin]["Name"], new[isin]["Name"]] for isin in kept
+                            if old[isin]["Name"] != new[isin]["Name"]},
+                'reticked': {isin: [old[isin]["Ticker"], new[isin]["Ticker"]] for isin in kept
+                             if old[isin]["Ticker"] != new[isin]["Ticker"]}
+            }
+        listed = {isin for assets in current.values() for isin in assets}
+        return {
+            'date': datetime.today().strftime("%Y-%m-%d"),
+            'classes': classes,
+            'delisted': sorted({isin for assets in previous.values() for isin in assets} - listed),
+            'ingested': False
+        }
+
+    @classmethod
+    def merge_diffs(cls, earlier: dict, later: dict) -> dict:
+        """
+        One diff with the changes of ``earlier`` and of the ``later`` one taken after it. What ``later`` says about
+        an ISIN wins: one added before and removed now is only removed, and the other way around. Renames and
+        re-ticks go from the oldest to the newest value, and are dropped when the newest is the oldest again.
+        """
+        empty = {'added': [], 'removed': [], 'renamed': {}, 'reticked': {}}
+        classes = {}
+        for asset_class in sorted(set(earlier['classes']) | set(later['classes'])):
+            first, second = earlier['classes'].get(asset_class, empty), later['classes'].get(asset_class, empty)
+            added, removed = set(second['added']), set(second['removed'])
+            classes[asset_class] = {
+                'added': sorted(added | (set(first['added']) - removed)),
+                'removed': sorted(removed | (set(first['removed']) - added)),
+                'renamed': cls._merge_changes(first['renamed'], second['renamed'], removed),
+                'reticked': cls._merge_changes(first['reticked'], second['reticked'], removed)
+            }
+        listed_again = {isin for changes in later['classes'].values() for isin in changes['added']}
+        return {
+            'date': later['date'],
+            'classes': classes,
+            'delisted': sorted((set(earlier['delisted']) - listed_again) | set(later['delisted'])),
+            'ingested': False
+        }
 
     @classmethod
-    def _get_assets_raw(cls):
+    def _merge_changes(cls, first: dict[str, list[str]], second: dict[str, list[str]],
+                       removed: set[str]) -> dict[str, list[str]]:
+        merged = {isin: change for isin, change in first.items() if isin not in removed}
+        for isin, (old, new) in second.items():
+            merged[isin] = [merged[isin][0] if isin in merged else old, new]
+        return {isin: [old, new] for isin, (old, new) in sorted(merged.items()) if old != new}
+
+    @classmethod
+    def changed_isins(cls, diff: dict, asset_class: str) -> list[str]:
+        """ISINs of ``asset_class`` that were added, renamed or re-ticked in ``diff``, without the excluded ones."""
+        changes = diff['classes'].get(asset_class)
+        if changes is None:
+            return []
+        changed = set(changes['added']) | set(changes['renamed']) | set(changes['reticked'])
+        return sorted(changed - cls.excluded_isins)
+
+    @classmethod
+    def _get_assets_raw(cls, data_source=None):
+        assets_raw = data_source.assets_raw() if data_source is not None else cls.download_assets_raw()
+        if assets_raw is not None:
+            with open(os.path.join(cls.data_directory, 'assets_raw.json'), 'w+') as file:
+                # noinspection PyTypeChecker
+                json.dump(assets_raw, file, indent=4)
+
+    @classmethod
+    def download_assets_raw(cls) -> list[dict] | None:
         session = requests.Session()
         retry = Retry(connect=3, backoff_factor=0.5)
         adapter = HTTPAdapter(max_retries=retry)
         session.mount('http://', adapter)
         session.mount('https://', adapter)
 
-        with open('/home/ruben/Projects/finfacts/passive-backtesting/beursrally/cookies.json', 'r') as file:
+        with open(os.path.join(cls.data_directory, 'cookies.json'), 'r') as file:
             cookies = json.load(file)
         data_response = session.get(cls.DATA_URL, cookies=cookies["Request Cookies"])
         if data_response.status_code != 200:
             print(f"Something went wrong: status code {data_response.status_code}\n{data_response.text}")
-        else:
-            with open('/home/ruben/Projects/finfacts/passive-backtesting/beursrally/assets_raw.json', 'w+') as file:
-                # noinspection PyTypeChecker
-                json.dump(data_response.json(), file, indent=4)
+            return None
+        return data_response.json()
 
     @classmethod
-    def _filter_assets(cls):
-        with open('/home/ruben/Projects/finfacts/passive-backtesting/beursrally/assets_raw.json', 'r') as file:
+    def _filter_assets(cls) -> dict[str, dict[str, dict[str, str]]]:
+        with open(os.path.join(cls.data_directory, 'assets_raw.json'), 'r') as file:
             data = json.load(file)
 
         assets = dict()
@@ -70,10 +241,7 @@ class BeursrallyAssets:
                 assets[item["AsseType"]][item["ISIN"]] = dict()
             for key in ["Name", "Ticker"]:
                 assets[item["AsseType"]][item["ISIN"]][key] = item[key]
-
-        with open('/home/ruben/Projects/finfacts/passive-backtesting/beursrally/assets.json', 'w+') as file:
-            # noinspection PyTypeChecker
-            json.dump(assets, file, indent=4)
+        return assets
 
 
 if __name__ == "__main__":
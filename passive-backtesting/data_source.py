@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from datetime import date as Date, datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from requests import Session
+from requests_cache import CacheMixin, SQLiteCache
+from requests_ratelimiter import LimiterMixin, MemoryQueueBucket
+from pyrate_limiter import Duration, RequestRate, Limiter
+
+from instrumentation import Instrumentation
+
+
+class _NetworkTimedSession(Session):
+    """Innermost layer of :class:`CachedLimiterSession`, only reached for requests that really go out."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._network_time = threading.local()
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            self._network_time.seconds = time.perf_counter() - start
+
+
+class CachedLimiterSession(CacheMixin, LimiterMixin, _NetworkTimedSession):
+    instrumentation: Instrumentation | None = None
+    '''when set, every request reports its cache hit or miss, network time and rate limiter wait into it'''
+
+    def send(self, request, **kwargs):
+        if self.instrumentation is None:
+            return super().send(request, **kwargs)
+        self._network_time.seconds = 0.0
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        total = time.perf_counter() - start
+        if getattr(response, 'from_cache', False):
+            self.instrumentation.count("http.cache_hits")
+            self.instrumentation.add_time("http.cache_read", total)
+        else:
+            # The limiter wraps the network call, whatever the request spent outside of it was spent waiting
+            network = self._network_time.seconds
+            self.instrumentation.count("http.cache_misses")
+            self.instrumentation.add_time("http.network", network)
+            self.instrumentation.add_time("http.limiter_wait", max(total - network, 0.0))
+        return response
+
+
+def cached_limiter_session(instrumentation: Instrumentation | None = None) -> CachedLimiterSession:
+    """The session every Yahoo request goes through: cached on disk and limited to 1 request per 5 seconds."""
+    session = CachedLimiterSession(
+        limiter=Limiter(RequestRate(1, Duration.SECOND * 5)),
+        bucket_class=MemoryQueueBucket,
+        backend=SQLiteCache("yfinance.cache")
+    )
+    session.instrumentation = instrumentation
+    return session
+
+
+class DataSource(ABC):
+    """
+    Everything ingestion downloads: yfinance ``info``, ``calendar`` and history per ISIN, and the raw Beursrally
+    asset list. Implementations must be safe to call from several threads at once.
+    """
+
+    @abstractmethod
+    def info(self, isin: str) -> dict:
+        ...
+
+    @abstractmethod
+    def calendar(self, isin: str) -> dict:
+        ...
+
+    @abstractmethod
+    def history(self, isin: str, period: str | None = None, start: str | None = None,
+                interval: str = "1mo") -> pd.DataFrame:
+        ...
+
+    @abstractmethod
+    def assets_raw(self) -> list[dict]:
+        ...
+
+
+class LiveDataSource(DataSource):
+    """Yahoo Finance through :func:`cached_limiter_session` and the Beursrally search API."""
+
+    def __init__(self, session: Session | None = None, instrumentation: Instrumentation | None = None):
+        self.session = session if session is not None else cached_limiter_session(instrumentation)
+
+    def info(self, isin: str) -> dict:
+        return yf.Ticker(isin, session=self.session).info
+
+    def calendar(self, isin: str) -> dict:
+        return yf.Ticker(isin, session=self.session).calendar
+
+    def history(self, isin: str, period: str | None = None, start: str | None = None,
+                interval: str = "1mo") -> pd.DataFrame:
+        return yf.Ticker(isin, session=self.session).history(period=period, start=start, interval=interval)
+
+    def assets_raw(self) -> list[dict]:
+        from beursrally.assets import BeursrallyAssets
+        return BeursrallyAssets.download_assets_raw()
+
+
+def _encode_dates(value):
+    if isinstance(value, (datetime, Date)):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value)}")
+
+
+def _decode_dates(value: dict):
+    if set(value) == {'__date__'}:
+        return Date.fromisoformat(value['__date__'][:10])
+    return value
+
+
+def _filter_history(frame: pd.DataFrame, start: str | None) -> pd.DataFrame:
+    if start is None:
+        return frame
+    return frame[frame.index.strftime("%Y-%m-%d") >= start]
+
+
+class _SimulatedLatency:
+    def __init__(self, latency: float, jitter: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+
+    def wait(self, *key):
+        if self.latency <= 0 and self.jitter <= 0:
+            return
+        # Seeded per request rather than per call order, so concurrent runs sleep the same
+        rng = random.Random(f"{self.seed}-{'-'.join(key)}")
+        time.sleep(max(self.latency + rng.uniform(-self.jitter, self.jitter), 0.0))
+
+
+class RecordingDataSource(DataSource):
+    """Passes every request on to ``source`` and saves the response as a fixture for :class:`ReplayDataSource`."""
+
+    def __init__(self, source: DataSource, fixture_path: str):
+        self.source = source
+        self.fixture_path = fixture_path
+
+    def _path(self, isin: str, name: str) -> str:
+        directory = os.path.join(self.fixture_path, isin)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    def info(self, isin: str) -> dict:
+        info = self.source.info(isin)
+        with open(self._path(isin, "info.json"), 'w') as file:
+            # noinspection PyTypeChecker
+            json.dump(info, file, indent=4, default=_encode_dates)
+        return info
+
+    def calendar(self, isin: str) -> dict:
+        calendar = self.source.calendar(isin)
+        with open(self._path(isin, "calendar.json"), 'w') as file:
+            # noinspection PyTypeChecker
+            json.dump(calendar, file, indent=4, default=_encode_dates)
+        return calendar
+
+    def history(self, isin: str, period: str | None = None, start: str | None = None,
+                interval: str = "1mo") -> pd.DataFrame:
+        # Always record the full history, replays apply ``start`` themselves
+        history = self.source.history(isin, period="max", interval=interval)
+        history.to_csv(self._path(isin, f"history-int_{interval}.csv"), sep=',')
+        return _filter_history(history, start)
+
+    def assets_raw(self) -> list[dict]:
+        assets = self.source.assets_raw()
+        os.makedirs(self.fixture_path, exist_ok=True)
+        with open(os.path.join(self.fixture_path, "assets_raw.json"), 'w') as file:
+            # noinspection PyTypeChecker
+            json.dump(assets, file, indent=4)
+        return assets
+
+
+class ReplayDataSource(DataSource):
+    """Serves fixtures saved by :class:`RecordingDataSource` from disk, after a configurable simulated latency."""
+
+    def __init__(self, fixture_path: str, latency: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        """
+        :param latency: seconds every request takes on average
+        :param jitter: maximum deviation from ``latency``, drawn uniformly
+        """
+        self.fixture_path = fixture_path
+        self._latency = _SimulatedLatency(latency, jitter, seed)
+
+    def _load_json(self, isin: str, name: str):
+        with open(os.path.join(self.fixture_path, isin, name), 'r') as file:
+            return json.load(file, object_hook=_decode_dates)
+
+    def info(self, isin: str) -> dict:
+        self._latency.wait(isin, "info")
+        return self._load_json(isin, "info.json")
+
+    def calendar(self, isin: str) -> dict:
+        self._latency.wait(isin, "calendar")
+        return self._load_json(isin, "calendar.json")
+
+    def history(self, isin: str, period: str | None = None, start: str | None = None,
+                interval: str = "1mo") -> pd.DataFrame:
+        self._latency.wait(isin, "history", interval)
+        history = pd.read_csv(os.path.join(self.fixture_path, isin, f"history-int_{interval}.csv"), index_col="Date")
+        history.index = pd.to_datetime(history.index.str[:10])
+        history.index.name = "Date"
+        return _filter_history(history, start)
+
+    def assets_raw(self) -> list[dict]:
+        self._latency.wait("assets_raw")
+        with open(os.path.join(self.fixture_path, "assets_raw.json"), 'r') as file:
+            return json.load(file)
+
+
+class SyntheticDataSource(DataSource):
+    """
+    A made-up universe of ``n_isins`` stocks with plausible info, calendars and random walk price histories. Every
+    response only depends on the seed, the ISIN and the date range, so runs are reproducible regardless of
+    concurrency and of the day they run on.
+    """
+
+    CURRENCIES = ("EUR", "USD", "GBP", "CHF")
+    EXCHANGES = ("AMS", "BRU", "PAR", "NYQ", "LSE", "EBS")
+    ASSET_TYPES = ("Aandelen", "ETF", "Beleggingsfondsen")
+
+    def __init__(self, n_isins: int = 1000, latency: float = 0.0, jitter: float = 0.0, seed: int = 0,
+                 first_date: str = "1990-01-01", end_date: str = "2025-12-31"):
+        """
+        :param first_date: first candle of every history
+        :param end_date: stands in for today: the last candle of every history, and calendars are around it
+        """
+        self.n_isins = n_isins
+        self.seed = seed
+        self.first_date = first_date
+        self.end_date = Date.fromisoformat(end_date)
+        self._latency = _SimulatedLatency(latency, jitter, seed)
+
+    def isins(self) -> list[str]:
+        return [f"XS{self.seed % 100:02d}{i:08d}" for i in range(self.n_isins)]
+
+    def _rng(self, isin: str) -> random.Random:
+        return random.Random(f"{self.seed}-{isin}")
+
+    def info(self, isin: str) -> dict:
+        self._latency.wait(isin, "info")
+        rng = self._rng(isin)
+        return {
+            'symbol': f"S{isin[-6:]}",
+            'shortName': f"Synthetic {isin}",
+            'currency': rng.choice(self.CURRENCIES),
+            'exchange': rng.choice(self.EXCHANGES),
+            'firstTradeDateEpochUtc': int(datetime(1980 + rng.randrange(40), 1, 1, tzinfo=timezone.utc).timestamp()),
+            'marketCap': rng.randrange(10 ** 7, 10 ** 12),
+            'enterpriseValue': rng.randrange(10 ** 7, 10 ** 12),
+            'averageVolume': rng.randrange(10 ** 3, 10 ** 7),
+            'averageVolume10days': rng.randrange(10 ** 3, 10 ** 7),
+            'beta': rng.uniform(0.2, 2.0),
+            'trailingPE': rng.uniform(3, 60),
+            'forwardPE': rng.uniform(3, 60),
+            'priceToBook': rng.uniform(0.3, 15),
+            'trailingEps': rng.uniform(-5, 20),
+            'forwardEps': rng.uniform(-5, 20),
+            'enterpriseToRevenue': rng.uniform(0.2, 20),
+            'enterpriseToEbitda': rng.uniform(2, 40)
+        }
+
+    def calendar(self, isin: str) -> dict:
+        self._latency.wait(isin, "calendar")
+        rng = self._rng(isin)
+        earnings = self.end_date + timedelta(days=rng.randrange(1, 90))
+        ex_dividend = self.end_date - timedelta(days=rng.randrange(1, 180))
+        return {
+            'Dividend Date': ex_dividend + timedelta(days=14),
+            'Ex-Dividend Date': ex_dividend,
+            'Earnings Date': [earnings]
+        }
+
+    def history(self, isin: str, period: str | None = None, start: str | None = None,
+                interval: str = "1mo") -> pd.DataFrame:
+        self._latency.wait(isin, "history", interval)
+        frequency = {"1mo": "MS", "1wk": "W-MON", "1d": "B"}[interval]
+        dates = pd.date_range(self.first_date, self.end_date, freq=frequency, name="Date")
+        rng = np.random.default_rng(zlib.crc32(f"{self.seed}-{isin}-{interval}".encode()))
+        drift, volatility = {"1mo": (0.006, 0.06), "1wk": (0.0015, 0.03), "1d": (0.0003, 0.013)}[interval]
+        close = 10 * np.exp(np.cumsum(rng.normal(drift, volatility, len(dates))))
+        history = pd.DataFrame({
+            'Open': close * (1 + rng.normal(0, volatility / 4, len(dates))),
+            'High': close * (1 + np.abs(rng.normal(0, volatility / 2, len(dates)))),
+            'Low': close * (1 - np.abs(rng.normal(0, volatility / 2, len(dates)))),
+            'Close': close,
+            'Volume': rng.integers(10 ** 3, 10 ** 7, len(dates)).astype(np.float64),
+            'Dividends': np.where(rng.random(len(dates)) < 0.05, close * 0.01, 0.0),
+            'Stock Splits': 0.0
+        }, index=dates)
+        return _filter_history(history, start)
+
+    def assets_raw(self) -> list[dict]:
+        self._latency.wait("assets_raw")
+        # 70% stocks, 20% ETFs and 10% funds
+        return [{'AsseType': self.ASSET_TYPES[(i % 10 > 6) + (i % 10 > 8)], 'ISIN': isin, 'Name': f"Synthetic {isin}",
+                 'Ticker': f"S{isin[-6:]}"}
+                for i, isin in enumerate(self.isins())]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record live responses as fixtures for ReplayDataSource")
+    parser.add_argument("fixtures", help="directory to save the fixtures in")
+    parser.add_argument("isins", nargs="+")
+    args = parser.parse_args()
+
+    recorder = RecordingDataSource(LiveDataSource(), args.fixtures)
+    recorder.assets_raw()
+    for recorded_isin in args.isins:
+        print(f"Recording {recorded_isin}")
+        recorder.info(recorded_isin)
+        recorder.calendar(recorded_isin)
+        recorder.history(recorded_isin, period="max", interval="1mo")
@@ -1,11 +1,48 @@
+import argparse
+import os
 import sqlite3
-from datetime import datetime
-from functools import cmp_to_key
+from contextlib import contextmanager
+from datetime import date as Date
 
 from typing import Union, Tuple
 
+import pandas as pd
+
+from instrumentation import Instrumentation
+
+
+def _insert_if_changed(table: str, columns: tuple[str, ...]) -> str:
+    """
+    Statement taking the same parameters as the snapshot upserts, that skips the row when the latest snapshot on or
+    before its date already holds the same values (``IS`` also matches missing ones).
+    """
+    values = ", ".join(f"?{i}" for i in range(3, len(columns) + 3))
+    unchanged = " AND ".join(f"{column} IS ?{i}" for i, column in enumerate(columns, 3))
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns)
+    return f'''
+        INSERT INTO {table}
+        (isin, date, {', '.join(columns)})
+        SELECT ?1, ?2, {values}
+        WHERE NOT EXISTS (
+            SELECT 1 FROM (SELECT {', '.join(columns)} FROM {table}
+                           WHERE isin = ?1 AND date <= ?2 ORDER BY date DESC LIMIT 1)
+            WHERE {unchanged})
+        ON CONFLICT (isin, date) DO UPDATE SET {updates}'''
+
 
 class StockDataDB:
+    DATE_FORMAT = "%Y-%m-%d"
+    '''ISO dates sort the same lexically and chronologically, so ordering and ranges can be done in SQL'''
+
+    ABSOLUTES_FIELDS = ("marketCap", "enterpriseValue", "averageVolume", "averageVolume10days")
+    '''value columns of the ABSOLUTES snapshots, in table order'''
+    RATIOS_FIELDS = ("beta", "trailingPE", "forwardPE", "priceToBook", "trailingEps", "forwardEps",
+                     "enterpriseToRevenue", "enterpriseToEbitda")
+    '''value columns of the RATIOS snapshots, in table order'''
+
+    SCHEMA_VERSION = 3
+    '''stored in ``PRAGMA user_version``, see :meth:`_migrate`'''
+
     Metadata = tuple[str, str, str, str, str, str]
     '''isin, symbol, name, currency, exchange, firstTradeDate'''
 
@@ -17,14 +54,170 @@ class StockDataDB:
     Ratios = tuple[
         str, str, MaybeFloat, MaybeFloat, MaybeFloat, MaybeFloat, MaybeFloat, MaybeFloat, MaybeFloat, MaybeFloat]
 
-    def __init__(self, verbose=False):
-        self.connection = sqlite3.connect('finfacts.db')
+    def __init__(self, verbose=False, path: str = 'finfacts.db', wal: bool = False,
+                 synchronous: str | None = None, instrumentation: Instrumentation | None = None,
+                 delta: bool = False):
+        """
+        :param path: location of the SQLite database file
+        :param wal: switch the database to write-ahead logging, so readers don't block the writer
+        :param synchronous: value for ``PRAGMA synchronous`` (e.g. "NORMAL" or "OFF"), left at the SQLite
+            default when None
+        :param instrumentation: counts rows written and commits and times the writes, a new one when None
+        :param delta: only store an absolutes or ratios snapshot when one of its values differs from the snapshot
+            before it, see :meth:`compact_snapshots`
+        """
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.connection = sqlite3.connect(path)
         self.cursor = self.connection.cursor()
+        if wal:
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+        if synchronous is not None:
+            self.cursor.execute(f"PRAGMA synchronous={synchronous}")
         self._create_meta_table_if_not_exists()
         self._create_absolutes_table_if_not_exists()
         self._create_ratios_table_if_not_exists()
         self._create_events_table_if_not_exists()
+        self._create_snapshot_checks_table_if_not_exists()
+        self._migrate()
         self.verbose = verbose
+        self.delta = delta
+        self._pending: dict[str, list[tuple]] = {}
+        self._pending_rows = 0
+        self._batch_size: int | None = None
+
+    def _migrate(self):
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # Rewrite dd_mm_yyyy dates as ISO yyyy-mm-dd
+            for table, column in [("META", "firstTradeDate"), ("ABSOLUTES", "date"), ("RATIOS", "date"),
+                                  ("EVENTS", "date")]:
+                self.cursor.execute(f'''
+                    UPDATE {table}
+                    SET {column} = substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-'
+                                   || substr({column}, 1, 2)
+                    WHERE {column} GLOB '[0-9][0-9]_[0-9][0-9]_[0-9][0-9][0-9][0-9]'
+                ''')
+            # Older inserts quoted missing values as the text 'NULL'
+            for table, columns in [("ABSOLUTES", self.ABSOLUTES_FIELDS), ("RATIOS", self.RATIOS_FIELDS)]:
+                for column in columns:
+                    self.cursor.execute(f"UPDATE {table} SET {column} = NULL WHERE {column} = 'NULL'")
+            # (isin, date) lookups are served by the primary keys, these cover date-only scans
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS ABSOLUTES_date ON ABSOLUTES (date)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS RATIOS_date ON RATIOS (date)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS EVENTS_date ON EVENTS (date)")
+        if version < 2:
+            # Snapshots stored so far were checked on the day they were taken
+            for table, column in [("ABSOLUTES", "absolutes"), ("RATIOS", "ratios")]:
+                self.cursor.execute(f'''
+                    INSERT INTO SNAPSHOT_CHECKS (isin, {column})
+                    SELECT isin, MAX(date) FROM {table} WHERE 1 GROUP BY isin
+                    ON CONFLICT (isin) DO UPDATE SET {column} = MAX(COALESCE({column}, ''), excluded.{column})
+                ''')
+        if version < 3:
+            # Date an ISIN dropped out of the Beursrally universe, NULL while it is listed
+            self.cursor.execute("ALTER TABLE META ADD COLUMN delisted TEXT")
+        self.cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.connection.commit()
+
+    @classmethod
+    def date_string(cls, date: Date | str) -> str:
+        """Format a date the way it is stored, ISO strings are passed through unchanged."""
+        return date if isinstance(date, str) else date.strftime(cls.DATE_FORMAT)
+
+    @classmethod
+    def _date_range(cls, start: Date | str | None, end: Date | str | None) -> tuple[str, tuple]:
+        """SQL conditions and parameters selecting ``start <= date <= end``, either bound is optional."""
+        conditions, parameters = [], []
+        if start is not None:
+            conditions.append("date >= ?")
+            parameters.append(cls.date_string(start))
+        if end is not None:
+            conditions.append("date <= ?")
+            parameters.append(cls.date_string(end))
+        return " AND ".join(conditions) or "1", tuple(parameters)
+
+    @contextmanager
+    def batch(self, size: int = 5000):
+        """
+        Buffer every ``add_*`` call made inside the context and write them with ``executemany``, committing once
+        per ``size`` buffered rows and once more on exit. Rows still buffered when an exception escapes the
+        context are rolled back.
+        """
+        if self._batch_size is not None:
+            # Nested batches join the outer one
+            yield self
+            return
+        self._batch_size = size
+        try:
+            yield self
+            self.flush()
+        except BaseException:
+            self._pending.clear()
+            self._pending_rows = 0
+            self.connection.rollback()
+            raise
+        finally:
+            self._batch_size = None
+
+    def flush(self) -> set[str]:
+        """
+        Write and commit all rows buffered by :meth:`batch`. When a statement fails for some of its rows, they are
+        written one by one instead, and the failing rows are reported and left out, like outside a batch.
+
+        :return: ISINs of the rows that failed
+        """
+        if not self._pending:
+            return set()
+        failed: list[tuple] = []
+        with self.instrumentation.timer("db.write"):
+            for statement, rows in self._pending.items():
+                try:
+                    self.cursor.executemany(statement, rows)
+                except sqlite3.Error:
+                    # Every statement is an upsert, so writing the rows before the failing one again is harmless
+                    failed.extend(self._write_rows(statement, rows))
+        with self.instrumentation.timer("db.commit"):
+            self.connection.commit()
+        self.instrumentation.count("db.rows", self._pending_rows - len(failed))
+        self.instrumentation.count("db.commits")
+        self._pending.clear()
+        self._pending_rows = 0
+        return {row[0] for row in failed}
+
+    def _write_rows(self, statement: str, rows: list[tuple]) -> list[tuple]:
+        """Execute ``statement`` for every row separately, returns the rows that failed."""
+        failed = []
+        for row in rows:
+            try:
+                self.cursor.execute(statement, row)
+            except sqlite3.Error as err:
+                self.instrumentation.failure(row[0], "db", err)
+                print(f"-db- Failed to write a row for {row[0]}: {err}")
+                failed.append(row)
+        return failed
+
+    @property
+    def pending_rows(self) -> int:
+        """Rows buffered by :meth:`batch` that are not committed yet."""
+        return self._pending_rows
+
+    def _write(self, statement: str, row: tuple, description: str):
+        if self._batch_size is not None:
+            self._pending.setdefault(statement, []).append(row)
+            self._pending_rows += 1
+            if self._pending_rows >= self._batch_size:
+                self.flush()
+            return
+        try:
+            with self.instrumentation.timer("db.write"):
+                self.cursor.execute(statement, row)
+            with self.instrumentation.timer("db.commit"):
+                self.connection.commit()
+            self.instrumentation.count("db.rows")
+            self.instrumentation.count("db.commits")
+        except sqlite3.Error as err:
+            self.instrumentation.failure(row[0], "db", err)
+            print(f"-db- Failed to write {description}: {err}")
 
     def _create_meta_table_if_not_exists(self):
         create_metadata_table = '''
@@ -39,27 +232,41 @@ class StockDataDB:
         self.cursor.execute(create_metadata_table)
         self.connection.commit()
 
+    _UPSERT_METADATA = '''
+        INSERT INTO META
+        (isin, symbol, name, currency, exchange, firstTradeDate)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (isin) DO UPDATE SET
+            symbol = excluded.symbol, name = excluded.name, currency = excluded.currency,
+            exchange = excluded.exchange, firstTradeDate = excluded.firstTradeDate, delisted = NULL'''
+
     def add_metadata(self, isin: str, symbol: str, name: str, currency: str,
                      exchange: str, first_trade_date: str):
 
-        insert_metadata = f'''
-            INSERT INTO META
-            (isin, symbol, name, currency, exchange, firstTradeDate)
-            VALUES ('{isin}', '{symbol}', '{name}', '{currency}', '{exchange}', 
-            '{first_trade_date}')'''
-        try:
-            self.cursor.execute(insert_metadata)
-            self.connection.commit()
-        except sqlite3.IntegrityError as _:
-            if self.verbose:
-                print(f"-db- Metadata for {isin} already exists in the database")
-        except sqlite3.Error as err:
-            print(err)
+        if self.verbose:
+            print(f"-db- Writing metadata for {isin}")
+        self._write(self._UPSERT_METADATA, (isin, symbol, name, currency, exchange, first_trade_date),
+                    f"metadata for {isin}")
 
     def get_metadata(self, isin: str) -> Metadata:
-        metadata_query = f'''SELECT isin, symbol, name, currency, exchange, firstTradeDate 
-                             FROM META WHERE isin = {isin}'''
-        return self.cursor.execute(metadata_query).fetchone()
+        metadata_query = '''SELECT isin, symbol, name, currency, exchange, firstTradeDate 
+                             FROM META WHERE isin = ?'''
+        return self.cursor.execute(metadata_query, (isin,)).fetchone()
+
+    def mark_delisted(self, isins: list[str], date: Date | str):
+        """Record that ``isins`` left the universe on ``date``, storing their metadata again lists them again."""
+        self.flush()
+        self.cursor.executemany("UPDATE META SET delisted = ? WHERE isin = ? AND delisted IS NULL",
+                                [(self.date_string(date), isin) for isin in isins])
+        self.connection.commit()
+
+    def get_delisted(self) -> dict[str, str]:
+        """Date every delisted ISIN in META was delisted on."""
+        return dict(self.cursor.execute("SELECT isin, delisted FROM META WHERE delisted IS NOT NULL").fetchall())
+
+    def get_currencies(self) -> dict[str, str]:
+        """Currency of every ISIN in META."""
+        return dict(self.cursor.execute("SELECT isin, currency FROM META").fetchall())
 
     def _create_absolutes_table_if_not_exists(self):
         create_absolutes_table = '''
@@ -75,32 +282,36 @@ class StockDataDB:
         self.cursor.execute(create_absolutes_table)
         self.connection.commit()
 
+    _UPSERT_ABSOLUTES = '''
+        INSERT INTO ABSOLUTES
+        (isin, date, marketCap, enterpriseValue, averageVolume, averageVolume10days)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (isin, date) DO UPDATE SET
+            marketCap = excluded.marketCap, enterpriseValue = excluded.enterpriseValue,
+            averageVolume = excluded.averageVolume, averageVolume10days = excluded.averageVolume10days'''
+
+    _INSERT_CHANGED_ABSOLUTES = _insert_if_changed("ABSOLUTES", ABSOLUTES_FIELDS)
+
     def add_absolutes(self, isin: str, date: str, market_cap: int | None,
                       enterprise_value: int | None, average_volume: int | None,
                       average_volume_10days: int | None):
-        insert_absolutes = f'''
-            INSERT INTO ABSOLUTES
-            (isin, date, marketCap, enterpriseValue, averageVolume, 
-            averageVolume10days)
-            VALUES ('{isin}', '{date}', 
-            '{"NULL" if market_cap is None else market_cap}', 
-            '{"NULL" if enterprise_value is None else enterprise_value}', 
-            '{"NULL" if average_volume is None else average_volume}', 
-            '{"NULL" if average_volume_10days is None else average_volume_10days}')'''
-        try:
-            self.cursor.execute(insert_absolutes)
-            self.connection.commit()
-        except sqlite3.IntegrityError as _:
-            if self.verbose:
-                print(f"-db- Absolutes data for {isin} on {date} already exists in the database")
-        except sqlite3.Error as err:
-            print(err)
+        if self.verbose:
+            print(f"-db- Writing absolutes data for {isin} on {date}")
+        self._write(self._INSERT_CHANGED_ABSOLUTES if self.delta else self._UPSERT_ABSOLUTES,
+                    (isin, date, market_cap, enterprise_value, average_volume, average_volume_10days),
+                    f"absolutes data for {isin} on {date}")
+        self._write(self._UPSERT_ABSOLUTES_CHECK, (isin, date), f"absolutes check for {isin} on {date}")
+
+    def get_absolutes(self, isin: str, as_of: Date | str | None = None) -> Absolutes | None:
+        """Latest absolutes snapshot of ``isin`` on or before ``as_of`` (the most recent one when None)."""
+        return self._snapshot_as_of("ABSOLUTES", self.ABSOLUTES_FIELDS, isin, as_of)
 
-    def get_absolutes(self, isin: str) -> Absolutes:
-        absolutes_query = f'''SELECT isin, date, marketCap, enterpriseValue, averageVolume, averageVolume10days
-                             FROM ABSOLUTES WHERE isin = {isin}'''
-        results = self.cursor.execute(absolutes_query).fetchall()
-        return min(results, key=lambda tup: tup[1])
+    def get_absolutes_as_of(self, as_of: Date | str, isins: list[str] | None = None) -> pd.DataFrame:
+        """
+        Cross-section of the latest absolutes snapshot on or before ``as_of`` for every ISIN (or only ``isins``),
+        indexed by ISIN with one column per field and the snapshot ``date``.
+        """
+        return self._cross_section_as_of("ABSOLUTES", self.ABSOLUTES_FIELDS, as_of, isins)
 
     def _create_ratios_table_if_not_exists(self):
         create_ratios_table = '''
@@ -120,37 +331,120 @@ class StockDataDB:
         self.cursor.execute(create_ratios_table)
         self.connection.commit()
 
+    _UPSERT_RATIOS = '''
+        INSERT INTO RATIOS
+        (isin, date, beta, trailingPE, forwardPE, priceToBook, trailingEps,
+        forwardEps, enterpriseToRevenue, enterpriseToEbitda)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (isin, date) DO UPDATE SET
+            beta = excluded.beta, trailingPE = excluded.trailingPE, forwardPE = excluded.forwardPE,
+            priceToBook = excluded.priceToBook, trailingEps = excluded.trailingEps,
+            forwardEps = excluded.forwardEps, enterpriseToRevenue = excluded.enterpriseToRevenue,
+            enterpriseToEbitda = excluded.enterpriseToEbitda'''
+
+    _INSERT_CHANGED_RATIOS = _insert_if_changed("RATIOS", RATIOS_FIELDS)
+
     def add_ratios(self, isin: str, date: str, beta: float | None, trailing_pe: float | None,
                    forward_pe: float | None, price_to_book: float | None, trailing_eps: float | None,
                    forward_eps: float | None, enterprise_to_revenue: float | None,
                    enterprise_to_ebitda: float | None):
-        insert_ratios = f'''
-            INSERT INTO RATIOS
-            (isin, date, beta, trailingPE, forwardPE, priceToBook, trailingEps,
-            forwardEps, enterpriseToRevenue, enterpriseToEbitda)
-            VALUES ('{isin}', '{date}', '{"NULL" if beta is None else beta}', 
-            '{"NULL" if trailing_pe is None else trailing_pe}', 
-            '{"NULL" if forward_pe is None else forward_pe}', 
-            '{"NULL" if price_to_book is None else price_to_book}', 
-            '{"NULL" if trailing_eps is None else trailing_eps}', 
-            '{"NULL" if forward_eps is None else forward_eps}', 
-            '{"NULL" if enterprise_to_revenue is None else enterprise_to_revenue}',
-            '{"NULL" if enterprise_to_ebitda is None else enterprise_to_ebitda}')'''
-        try:
-            self.cursor.execute(insert_ratios)
-            self.connection.commit()
-        except sqlite3.IntegrityError as _:
-            if self.verbose:
-                print(f"-db- Ratios data for {isin} on {date} already exists in the database")
-        except sqlite3.Error as err:
-            print(err)
+        if self.verbose:
+            print(f"-db- Writing ratios data for {isin} on {date}")
+        self._write(self._INSERT_CHANGED_RATIOS if self.delta else self._UPSERT_RATIOS,
+                    (isin, date, beta, trailing_pe, forward_pe, price_to_book, trailing_eps, forward_eps,
+                     enterprise_to_revenue, enterprise_to_ebitda),
+                    f"ratios data for {isin} on {date}")
+        self._write(self._UPSERT_RATIOS_CHECK, (isin, date), f"ratios check for {isin} on {date}")
+
+    def get_ratios(self, isin: str, as_of: Date | str | None = None) -> Ratios | None:
+        """Latest ratios snapshot of ``isin`` on or before ``as_of`` (the most recent one when None)."""
+        return self._snapshot_as_of("RATIOS", self.RATIOS_FIELDS, isin, as_of)
 
-    def get_ratios(self, isin: str) -> Ratios:
-        ratios_query = f'''SELECT isin, date, beta, trailingPE, forwardPE, priceToBook, trailingEps, forwardEps, 
-                                  enterpriseToRevenue, enterpriseToEbitda
-                           FROM RATIOS WHERE isin = {isin}'''
-        results = self.cursor.execute(ratios_query).fetchall()
-        return min(results, key=lambda tup: tup[1])
+    def get_ratios_as_of(self, as_of: Date | str, isins: list[str] | None = None) -> pd.DataFrame:
+        """
+        Cross-section of the latest ratios snapshot on or before ``as_of`` for every ISIN (or only ``isins``),
+        indexed by ISIN with one column per field and the snapshot ``date``.
+        """
+        return self._cross_section_as_of("RATIOS", self.RATIOS_FIELDS, as_of, isins)
+
+    def get_latest_snapshot_dates(self) -> dict[str, str]:
+        """
+        Per ISIN, the date up to which both its absolutes and its ratios are known, i.e. the older of the two most
+        recent dates they were checked on. With delta storage that can be later than the last stored snapshot.
+        ISINs missing from either table are left out.
+        """
+        latest_query = '''
+            SELECT isin, MIN(absolutes, ratios) FROM SNAPSHOT_CHECKS
+            WHERE absolutes IS NOT NULL AND ratios IS NOT NULL'''
+        return dict(self.cursor.execute(latest_query).fetchall())
+
+    def _create_snapshot_checks_table_if_not_exists(self):
+        create_snapshot_checks_table = '''
+            CREATE TABLE IF NOT EXISTS SNAPSHOT_CHECKS (
+                isin TEXT NOT NULL PRIMARY KEY,
+                absolutes TEXT,
+                ratios TEXT
+            );'''
+        self.cursor.execute(create_snapshot_checks_table)
+        self.connection.commit()
+
+    _UPSERT_ABSOLUTES_CHECK = '''
+        INSERT INTO SNAPSHOT_CHECKS (isin, absolutes) VALUES (?, ?)
+        ON CONFLICT (isin) DO UPDATE SET absolutes = MAX(COALESCE(absolutes, ''), excluded.absolutes)'''
+
+    _UPSERT_RATIOS_CHECK = '''
+        INSERT INTO SNAPSHOT_CHECKS (isin, ratios) VALUES (?, ?)
+        ON CONFLICT (isin) DO UPDATE SET ratios = MAX(COALESCE(ratios, ''), excluded.ratios)'''
+
+    def compact_snapshots(self) -> dict[str, int]:
+        """
+        Convert stored daily snapshots to delta form by deleting every absolutes and ratios row whose values all
+        equal those of the row before it for the same ISIN. As-of reads return the same values afterwards.
+
+        :return: table -> number of rows deleted
+        """
+        self.flush()
+        deleted = {}
+        for table, columns in [("ABSOLUTES", self.ABSOLUTES_FIELDS), ("RATIOS", self.RATIOS_FIELDS)]:
+            unchanged = " AND ".join(f"{column} IS LAG({column}) OVER previous" for column in columns)
+            self.cursor.execute(f'''
+                DELETE FROM {table} WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER previous > 1 AND {unchanged} AS redundant
+                        FROM {table}
+                        WINDOW previous AS (PARTITION BY isin ORDER BY date))
+                    WHERE redundant)''')
+            deleted[table] = self.cursor.rowcount
+        self.connection.commit()
+        return deleted
+
+    def _snapshot_as_of(self, table: str, columns: tuple[str, ...], isin: str, as_of: Date | str | None):
+        condition, parameters = self._date_range(None, as_of)
+        snapshot_query = f'''SELECT isin, date, {', '.join(columns)} FROM {table}
+                              WHERE isin = ? AND {condition}
+                              ORDER BY date DESC LIMIT 1'''
+        return self.cursor.execute(snapshot_query, (isin,) + parameters).fetchone()
+
+    def _cross_section_as_of(self, table: str, columns: tuple[str, ...], as_of: Date | str,
+                             isins: list[str] | None) -> pd.DataFrame:
+        parameters = (self.date_string(as_of),)
+        isin_filter = ""
+        if isins is not None:
+            isin_filter = f"WHERE checked.isin IN ({', '.join('?' * len(isins))})"
+            parameters += tuple(isins)
+        # One primary key seek per ISIN instead of grouping the whole table. CROSS JOIN keeps SQLite from turning
+        # the join around and running the subquery for every stored row.
+        cross_section_query = f'''
+            SELECT snapshot.isin, snapshot.date, {', '.join('snapshot.' + column for column in columns)}
+            FROM SNAPSHOT_CHECKS AS checked
+            CROSS JOIN {table} AS snapshot
+            ON snapshot.isin = checked.isin
+            AND snapshot.date = (SELECT MAX(date) FROM {table} WHERE isin = checked.isin AND date <= ?)
+            {isin_filter}
+            ORDER BY checked.isin'''
+        rows = self.cursor.execute(cross_section_query, parameters).fetchall()
+        frame = pd.DataFrame.from_records(rows, columns=("isin", "date") + columns, index="isin")
+        return frame.astype({column: "float64" for column in columns})
 
     def _create_events_table_if_not_exists(self):
         create_events_table = '''
@@ -163,42 +457,54 @@ class StockDataDB:
         self.cursor.execute(create_events_table)
         self.connection.commit()
 
+    _UPSERT_EVENT = '''
+        INSERT INTO EVENTS
+        (isin, date, eventType)
+        VALUES (?, ?, ?)
+        ON CONFLICT (isin, date, eventType) DO NOTHING'''
+
     def add_event(self, isin: str, date: str, event_type: str):
-        insert_events = f'''
-            INSERT INTO EVENTS
-            (isin, date, eventType)
-            VALUES ('{isin}', '{date}', '{event_type}')'''
-        try:
-            self.cursor.execute(insert_events)
-            self.connection.commit()
-        except sqlite3.IntegrityError as _:
-            if self.verbose:
-                print(f"-db- {event_type} events data for {isin} on {date} already exists in the database")
-        except sqlite3.Error as err:
-            print(err)
+        if self.verbose:
+            print(f"-db- Writing {event_type} event for {isin} on {date}")
+        self._write(self._UPSERT_EVENT, (isin, date, event_type), f"{event_type} event for {isin} on {date}")
 
-    @classmethod
-    def _compare_on_date(cls, item1, item2):
-        date1 = datetime.strptime(item1[1], "%d_%m_%Y").strftime("%Y%m%d")
-        date2 = datetime.strptime(item2[1], "%d_%m_%Y").strftime("%Y%m%d")
-        if date1 < date2:
-            return -1
-        elif date1 > date2:
-            return 1
-        else:
-            return 0
-
-    def get_events_in_order(self):
-        get_all_events_ordered = '''SELECT * FROM EVENTS'''
-        res = self.cursor.execute(get_all_events_ordered)
-        rows = []
-        for row in res.fetchall():
-            rows.append(row)
-        return sorted(rows, key=cmp_to_key(self._compare_on_date))
+    Event = tuple[str, str, str]
+    '''isin, date, eventType'''
+
+    def get_events_in_order(self, start: Date | str | None = None, end: Date | str | None = None,
+                            event_type: str | None = None) -> list[Event]:
+        """All events between ``start`` and ``end`` (inclusive, both optional), ordered by date."""
+        condition, parameters = self._date_range(start, end)
+        if event_type is not None:
+            condition += " AND eventType = ?"
+            parameters += (event_type,)
+        events_query = f'''SELECT isin, date, eventType FROM EVENTS WHERE {condition}
+                            ORDER BY date, isin, eventType'''
+        return self.cursor.execute(events_query, parameters).fetchall()
+
+    def get_events(self, isin: str, start: Date | str | None = None, end: Date | str | None = None) -> list[Event]:
+        """Events of a single ISIN between ``start`` and ``end`` (inclusive, both optional), ordered by date."""
+        condition, parameters = self._date_range(start, end)
+        events_query = f'''SELECT isin, date, eventType FROM EVENTS WHERE isin = ? AND {condition}
+                            ORDER BY date, eventType'''
+        return self.cursor.execute(events_query, (isin,) + parameters).fetchall()
 
 
 if __name__ == "__main__":
-    db = StockDataDB()
-    for e in db.get_events_in_order():
-        print(e)
+    parser = argparse.ArgumentParser(description="List the stored events in order, or compact the snapshots")
+    parser.add_argument("--path", default="finfacts.db")
+    parser.add_argument("--compact", action="store_true",
+                        help="delete snapshots that repeat the previous one of their ISIN and vacuum the file")
+    args = parser.parse_args()
+
+    db = StockDataDB(path=args.path)
+    if args.compact:
+        size = os.path.getsize(args.path)
+        for compacted_table, rows in db.compact_snapshots().items():
+            print(f"Deleted {rows} unchanged {compacted_table} rows")
+        db.cursor.execute("VACUUM")
+        print(f"{args.path}: {size / 1e6:.1f} MB -> {os.path.getsize(args.path) / 1e6:.1f} MB")
+    else:
+        for e in db.get_events_in_order():
+            print(e)
     db.connection.close()
@@ -0,0 +1,144 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from data_source import DataSource, LiveDataSource
+from database import StockDataDB
+from price_store import PricePanel, PriceStore
+from total_return import TotalReturnStore
+
+PIVOT = "EUR"
+'''every FX series is stored as the value of one unit of a currency in this one, other bases are cross rates'''
+
+MINOR_UNITS = {
+    "GBp": ("GBP", 100),
+    "GBX": ("GBP", 100),
+    "ZAc": ("ZAR", 100),
+    "ILA": ("ILS", 100)
+}
+'''currencies Yahoo quotes some exchanges in, e.g. pence on the LSE -> the currency and how many of them make one'''
+
+
+def major_currency(currency: str) -> tuple[str, int]:
+    """``"GBp"`` -> ``("GBP", 100)``, currencies without a minor unit -> ``(currency, 1)``"""
+    return MINOR_UNITS.get(currency, (currency, 1))
+
+
+def fx_symbol(currency: str) -> str:
+    """Yahoo Finance symbol of the price of one ``currency`` in :data:`PIVOT`."""
+    return f"{currency}{PIVOT}=X"
+
+
+class FxStore:
+    """
+    FX candles in a :class:`PriceStore` of their own, one column per currency holding its value in :data:`PIVOT`.
+    Series are only fetched for currencies the store doesn't have yet, unless a refresh is asked for.
+    """
+
+    def __init__(self, directory: str):
+        self.store = PriceStore(directory)
+
+    def update(self, currencies: list[str], source: DataSource | None = None, interval: str = "1mo",
+               refresh: bool = False) -> PricePanel:
+        """
+        Fetch the series of ``currencies`` that aren't stored yet (all of them when ``refresh``), keep the other
+        stored ones and save the lot.
+        """
+        source = source if source is not None else LiveDataSource()
+        stored = self.store.load(mmap_mode=None) if self.store.exists() else None
+        frames = {currency: stored.frame(currency) for currency in stored.isins} if stored is not None else {}
+        wanted = {major_currency(currency)[0] for currency in currencies} - {PIVOT}
+        for currency in sorted(wanted):
+            if currency in frames and not refresh:
+                continue
+            print(f"Fetching {fx_symbol(currency)}")
+            try:
+                history = source.history(fx_symbol(currency), period="max", interval=interval)
+            except Exception as e:
+                print(f"Exception occurred for {fx_symbol(currency)}: {e}")
+                continue
+            # Keep the exchange-local dates, like the stored candles
+            history.index = pd.to_datetime(history.index.strftime("%Y-%m-%d"))
+            frames[currency] = history
+        panel = PricePanel.from_frames(frames)
+        self.store.save(panel)
+        return panel
+
+    def rates(self, dates: np.ndarray, currencies: list[str]) -> np.ndarray:
+        """
+        ``dates x currencies`` value of one unit of each currency in :data:`PIVOT`, from the last FX close on or
+        before every date. NaN before a series starts and for currencies without a stored series.
+        """
+        pivot_rates = np.full((len(dates), len(currencies)), np.nan)
+        fx = self.store.load() if self.store.exists() else None
+        for i, currency in enumerate(currencies):
+            if currency == PIVOT:
+                pivot_rates[:, i] = 1.0
+            elif fx is not None and currency in fx.isins:
+                valid = fx.valid[:, fx.column(currency)]
+                fx_dates, close = fx.dates[valid], fx.series(currency)[valid]
+                rows = np.searchsorted(fx_dates, dates, side="right") - 1
+                pivot_rates[:, i] = np.where(rows >= 0, close[np.maximum(rows, 0)], np.nan)
+        return pivot_rates
+
+
+class CurrencyConverter:
+    """
+    Base currency versions of one price panel. The exchange rates of every currency in the panel are looked up once
+    per base, and every price field is converted with a single broadcast multiplication by the rate column of each
+    ISIN's currency. Converted panels are kept per base currency.
+    """
+
+    FIELDS = ("Open", "High", "Low", "Close", "Dividends", TotalReturnStore.FIELD)
+    '''fields quoted in the currency of the ISIN, the others (volume, splits) are left as they are'''
+
+    def __init__(self, panel: PricePanel, currencies: dict[str, str], fx_store: FxStore):
+        """
+        :param panel: prices in the currency each ISIN is quoted in
+        :param currencies: ISIN -> quote currency, as in META
+        :param fx_store: where the exchange rates come from
+        """
+        self.panel = panel
+        self.currencies = currencies
+        self.fx_store = fx_store
+        self._converted: dict[str, PricePanel] = {}
+
+    def convert(self, base: str) -> PricePanel:
+        """The panel with all prices in ``base``, NaN for ISINs whose currency has no exchange rate."""
+        if base in self._converted:
+            return self._converted[base]
+        quoted = [major_currency(self.currencies.get(isin, "")) for isin in self.panel.isins]
+        groups = sorted({currency for currency, _ in quoted} | {base})
+        group_of = {currency: group for group, currency in enumerate(groups)}
+        pivot_rates = self.fx_store.rates(self.panel.dates, groups)
+        # Cross rates through the pivot, then one column per ISIN picked from its currency's group
+        rates = pivot_rates / pivot_rates[:, [group_of[base]]]
+        column_groups = np.array([group_of[currency] for currency, _ in quoted], dtype=np.intp)
+        units = np.array([units for _, units in quoted], dtype=np.float64)
+        missing = [currency for group, currency in enumerate(groups) if np.isnan(rates[:, group]).all()]
+        if missing:
+            print(f"No exchange rates to {base} for {', '.join(currency or '(unknown)' for currency in missing)}")
+
+        multipliers = rates[:, column_groups] / units
+        fields = dict(self.panel.fields)
+        for field in self.FIELDS:
+            if field in fields:
+                fields[field] = fields[field] * multipliers
+        converted = PricePanel(self.panel.dates, self.panel.isins, fields, self.panel.valid)
+        self._converted[base] = converted
+        return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch the FX series for every currency in META")
+    parser.add_argument("--fx", default="/home/ruben/Projects/finfacts/cache/fx-int_1mo")
+    parser.add_argument("--interval", default="1mo")
+    parser.add_argument("--refresh", action="store_true", help="fetch the stored series again as well")
+    args = parser.parse_args()
+
+    database = StockDataDB()
+    currencies_in_use = sorted(set(database.get_currencies().values()))
+    database.connection.close()
+    fx_panel = FxStore(args.fx).update(currencies_in_use, interval=args.interval, refresh=args.refresh)
+    print(f"Stored {len(fx_panel.isins)} FX series against {PIVOT}: {', '.join(fx_panel.isins)}")
@@ -1,42 +1,119 @@
+import argparse
 import os
-import json
 
-import yfinance as yf
+from beursrally.assets import BeursrallyAssets
+from data_source import DataSource, LiveDataSource
 
-from requests import Session
-from requests_cache import CacheMixin, SQLiteCache
-from requests_ratelimiter import LimiterMixin, MemoryQueueBucket
-from pyrate_limiter import Duration, RequestRate, Limiter
+CACHE_PATH = "/home/ruben/Projects/finfacts/cache/"
 
+INTERVALS = ("1mo", "1wk", "1d")
 
-def save_monthly_candles(isin: str):
-    data_cache_path = "/home/ruben/Projects/finfacts/cache/"
-    write_path = data_cache_path + f"{isin}-p_max-int_1mo.csv"
-    print(f"Saving monthly stock data for {isin}")
+
+def candles_path(isin: str, interval: str = "1mo") -> str:
+    return CACHE_PATH + f"{isin}-p_max-int_{interval}.csv"
+
+
+def monthly_candles_path(isin: str) -> str:
+    return candles_path(isin, "1mo")
+
+
+def save_candles(isin: str, interval: str = "1mo", source: DataSource | None = None) -> bool:
+    """Store the full ``interval`` history of ``isin`` unless it is stored already, False when fetching it failed."""
+    source = source if source is not None else data_source
+    write_path = candles_path(isin, interval)
+    print(f"Saving {interval} stock data for {isin}")
     if not os.path.exists(write_path):
         try:
-            ticker = yf.Ticker(isin, session=session)
-            monthly_history = ticker.history(period="max", interval="1mo")
-            monthly_history.to_csv(write_path, sep=',')
+            history = source.history(isin, period="max", interval=interval)
+            history.to_csv(write_path, sep=',')
             print(f"Stock data saved for {isin}")
         except Exception as e:
             print(f"Exception occurred for {isin}: {e}")
+            return False
     else:
         print(f"Data for {isin} already exists")
+    return True
+
+
+def save_monthly_candles(isin: str, source: DataSource | None = None):
+    save_candles(isin, "1mo", source)
+
+
+def _last_candle(path: str) -> tuple[str | None, int]:
+    """Date of the last candle stored in ``path`` (None if it only has a header) and the offset its line starts at."""
+    with open(path, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        end = file.tell()
+        block = min(end, 4096)
+        file.seek(end - block)
+        tail = file.read(block).rstrip(b"\r\n")
+    start = tail.rfind(b"\n") + 1
+    last_line = tail[start:].decode()
+    if last_line.startswith("Date"):
+        return None, end
+    return last_line.split(",", 1)[0][:10], end - block + start
+
+
+def update_candles(isin: str, interval: str = "1mo", source: DataSource | None = None) -> bool:
+    """
+    Bring the stored ``interval`` candles of ``isin`` up to date by fetching only the ones from its last stored
+    candle onwards. That last candle may still have been open when it was stored, so it is replaced by the fresh
+    one when the source still returns it, and the newer candles are appended to the file in place. ISINs without
+    stored candles get their full history. Returns False when fetching the candles failed.
+    """
+    source = source if source is not None else data_source
+    path = candles_path(isin, interval)
+    last_date, offset = _last_candle(path) if os.path.exists(path) else (None, 0)
+    if last_date is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return save_candles(isin, interval, source)
+
+    print(f"Updating {interval} stock data for {isin} from {last_date}")
+    try:
+        new_history = source.history(isin, start=last_date, interval=interval)
+    except Exception as e:
+        print(f"Exception occurred for {isin}: {e}")
+        return False
+    new_history = new_history[new_history.index.strftime("%Y-%m-%d") >= last_date]
+    if new_history.empty:
+        print(f"No new candles for {isin}")
+        return True
+
+    with open(path, 'r') as file:
+        columns = file.readline().rstrip("\r\n").split(",")[1:]
+    replaces_last = new_history.index[0].strftime("%Y-%m-%d") == last_date
+    with open(path, 'r+b') as file:
+        if replaces_last:
+            file.truncate(offset)
+        else:
+            # Keep the stored candle, the new ones go on the lines after it
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                file.write(b"\n")
+    new_history.reindex(columns=columns).to_csv(path, sep=',', mode='a', header=False)
+    if replaces_last:
+        print(f"Stored {len(new_history)} candles for {isin}, the first one replacing the candle of {last_date}")
+    else:
+        print(f"Stored {len(new_history)} candles for {isin} after the candle of {last_date}")
+    return True
+
+
+def update_monthly_candles(isin: str, source: DataSource | None = None):
+    update_candles(isin, "1mo", source)
 
-class CachedLimiterSession(CacheMixin, LimiterMixin, Session):
-    pass
 
-session = CachedLimiterSession(
-    limiter=Limiter(RequestRate(1, Duration.SECOND*5)),
-    bucket_class=MemoryQueueBucket,
-    backend=SQLiteCache("yfinance.cache")
-)
+data_source: DataSource = LiveDataSource()
 
-with open("/passive-backtesting/beursrally/assets_filtered.json", "r") as file:
-    data = json.load(file)
-    
-stock_isins = data["Stock"].keys()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store candles for every Beursrally stock")
+    parser.add_argument("--interval", default="1mo", choices=INTERVALS)
+    parser.add_argument("--update", action="store_true",
+                        help="append the latest candles to stored histories instead of skipping them")
+    args = parser.parse_args()
 
-for isin in stock_isins:
-    save_monthly_candles(isin)
+    for isin in BeursrallyAssets.stock_isins():
+        if args.update:
+            update_candles(isin, args.interval)
+        else:
+            save_candles(isin, args.interval)
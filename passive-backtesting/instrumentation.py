@@ -0,0 +1,83 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Instrumentation:
+    """
+    Thread-safe per-stage timers and counters that ingestion reports into, plus the failures per ISIN. Stage names
+    are dotted, e.g. ``http.network`` or ``db.commit``, and group together in the report.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.timers: dict[str, list[float]] = {}
+        '''stage -> [calls, total seconds, longest call in seconds]'''
+        self.counters: dict[str, int] = {}
+        self.failures: dict[str, list[str]] = {}
+        '''isin -> "stage: error" for every failure of that ISIN'''
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            timer = self.timers.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def count(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def failure(self, isin: str, stage: str, error: BaseException | str):
+        with self._lock:
+            self.failures.setdefault(isin, []).append(f"{stage}: {error!r}")
+            self.counters[f"failures.{stage}"] = self.counters.get(f"failures.{stage}", 0) + 1
+
+    def cache_hit_ratio(self) -> float | None:
+        hits = self.counters.get("http.cache_hits", 0)
+        requests = hits + self.counters.get("http.cache_misses", 0)
+        return hits / requests if requests else None
+
+    def snapshot(self) -> dict:
+        """Everything recorded so far as plain, JSON-serialisable data."""
+        with self._lock:
+            return {
+                'elapsed': time.perf_counter() - self._started,
+                'timers': {stage: {'calls': calls, 'total': total, 'max': longest}
+                           for stage, (calls, total, longest) in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'cache_hit_ratio': self.cache_hit_ratio(),
+                'failures': dict(sorted(self.failures.items()))
+            }
+
+    def dump(self, path: str):
+        with open(path, 'w') as file:
+            # noinspection PyTypeChecker
+            json.dump(self.snapshot(), file, indent=4)
+
+    def report(self) -> str:
+        snapshot = self.snapshot()
+        lines = [f"{'stage':24s} {'calls':>8s} {'total s':>10s} {'mean ms':>10s} {'max ms':>10s}"]
+        for stage, timer in snapshot['timers'].items():
+            mean = timer['total'] / timer['calls'] if timer['calls'] else 0.0
+            lines.append(f"{stage:24s} {timer['calls']:8d} {timer['total']:10.2f} {mean * 1000:10.1f} "
+                         f"{timer['max'] * 1000:10.1f}")
+        for counter, value in snapshot['counters'].items():
+            lines.append(f"{counter:24s} {value:8d}")
+        if snapshot['cache_hit_ratio'] is not None:
+            lines.append(f"{'cache hit ratio':24s} {snapshot['cache_hit_ratio']:8.1%}")
+        lines.append(f"{'elapsed':24s} {snapshot['elapsed']:19.2f}")
+        if snapshot['failures']:
+            lines.append(f"Failures ({len(snapshot['failures'])} ISINs):")
+            lines.extend(f"  {isin}: {'; '.join(errors)}" for isin, errors in snapshot['failures'].items())
+        return "\n".join(lines)
@@ -0,0 +1,242 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from price_store import PriceStore
+
+PERIODS_PER_YEAR = {"1mo": 12, "1wk": 52, "1d": 252}
+
+
+def _columns(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    return values[:, None] if values.ndim == 1 else values
+
+
+def previous_valid(values: np.ndarray) -> np.ndarray:
+    """Per row, the last valid value in an earlier row of the same column (NaN if there is none)."""
+    valid = ~np.isnan(values)
+    last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(values))[:, None], -1), axis=0)
+    previous = np.vstack([np.full((1, values.shape[1]), -1), last_valid[:-1]])
+    return np.where(previous >= 0, np.take_along_axis(values, np.maximum(previous, 0), axis=0), np.nan)
+
+
+def returns(values: np.ndarray) -> np.ndarray:
+    """
+    Per period returns of every column of a ``periods x series`` array of values, NaN where a column has no value.
+    Gaps are bridged, the first value after one is compared with the last one before it.
+    """
+    values = _columns(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return values / previous_valid(values) - 1
+
+
+def time_weighted(values: np.ndarray, invested: np.ndarray) -> np.ndarray:
+    """
+    Unit value index (1.0 at the start) of a portfolio that receives contributions, such as
+    ``BacktestResult.values`` and ``.invested``. Every period's contribution is taken out of its growth, so the
+    metrics measure the strategy instead of the savings rate.
+    """
+    values, invested = _columns(values), _columns(invested)
+    contributions = np.diff(invested, axis=0, prepend=0.0)
+    previous = np.vstack([np.zeros((1, values.shape[1])), values[:-1]])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = np.where(previous > 0, (values - contributions) / previous, 1.0)
+    return np.cumprod(growth, axis=0)
+
+
+def cagr(values: np.ndarray, periods_per_year: int = 12) -> np.ndarray:
+    """Compound annual growth rate from the first to the last valid value of every column."""
+    values = _columns(values)
+    valid = ~np.isnan(values)
+    rows = np.arange(len(values))[:, None]
+    first = np.where(valid, rows, len(values)).min(axis=0)
+    last = np.where(valid, rows, -1).max(axis=0)
+    columns = np.arange(values.shape[1])
+    start = values[np.minimum(first, len(values) - 1), columns]
+    end = values[np.maximum(last, 0), columns]
+    years = (last - first) / periods_per_year
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(years > 0, (end / start) ** (1 / years) - 1, np.nan)
+
+
+def drawdowns(values: np.ndarray) -> np.ndarray:
+    """Every value relative to the highest one before it minus one, i.e. 0 at a peak and -0.2 when 20% below it."""
+    values = _columns(values)
+    return values / np.fmax.accumulate(values, axis=0) - 1
+
+
+def max_drawdown(values: np.ndarray) -> np.ndarray:
+    """Deepest drawdown of every column, as a negative fraction."""
+    return np.fmin.reduce(drawdowns(values), axis=0)
+
+
+def drawdown_duration(values: np.ndarray) -> np.ndarray:
+    """Longest number of valid periods every column spent below its previous peak."""
+    values = _columns(values)
+    valid = ~np.isnan(values)
+    underwater = valid & (values < np.fmax.accumulate(values, axis=0))
+    # Count valid periods only, and restart the count at every period back at a peak
+    periods = np.cumsum(valid, axis=0)
+    last_peak = np.maximum.accumulate(np.where(valid & ~underwater, periods, 0), axis=0)
+    return np.where(underwater, periods - last_peak, 0).max(axis=0, initial=0)
+
+
+def volatility(values: np.ndarray, periods_per_year: int = 12) -> np.ndarray:
+    """Annualised standard deviation of the returns of every column."""
+    period_returns = returns(values)
+    counts = np.sum(~np.isnan(period_returns), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.nansum(period_returns, axis=0) / counts
+        variance = np.nansum((period_returns - mean) ** 2, axis=0) / (counts - 1)
+    return np.where(counts > 1, np.sqrt(variance * periods_per_year), np.nan)
+
+
+def sharpe(values: np.ndarray, risk_free: float = 0.0, periods_per_year: int = 12) -> np.ndarray:
+    """Annualised Sharpe ratio of every column, ``risk_free`` being an annual rate."""
+    excess = returns(values) - risk_free / periods_per_year
+    counts = np.sum(~np.isnan(excess), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.nansum(excess, axis=0) / counts
+        deviation = np.sqrt(np.nansum((excess - mean) ** 2, axis=0) / (counts - 1))
+        return np.where(counts > 1, mean / deviation * np.sqrt(periods_per_year), np.nan)
+
+
+def sortino(values: np.ndarray, risk_free: float = 0.0, periods_per_year: int = 12) -> np.ndarray:
+    """Annualised Sortino ratio of every column: the mean excess return over the downside deviation."""
+    excess = returns(values) - risk_free / periods_per_year
+    counts = np.sum(~np.isnan(excess), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.nansum(excess, axis=0) / counts
+        downside = np.sqrt(np.nansum(np.minimum(excess, 0) ** 2, axis=0) / counts)
+        return np.where(counts > 1, mean / downside * np.sqrt(periods_per_year), np.nan)
+
+
+def rolling_returns(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Return over the last ``window`` periods at every period of every column, NaN for the first ``window`` periods
+    and where either end has no value.
+    """
+    values = _columns(values)
+    rolling = np.full(values.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rolling[window:] = values[window:] / values[:-window] - 1
+    return rolling
+
+
+def summary(values: np.ndarray, labels: list | None = None, risk_free: float = 0.0,
+            periods_per_year: int = 12) -> pd.DataFrame:
+    """All metrics of every column in one frame, indexed by ``labels`` (e.g. ISINs or sweep runs)."""
+    return pd.DataFrame({
+        'cagr': cagr(values, periods_per_year),
+        'volatility': volatility(values, periods_per_year),
+        'sharpe': sharpe(values, risk_free, periods_per_year),
+        'sortino': sortino(values, risk_free, periods_per_year),
+        'max_drawdown': max_drawdown(values),
+        'drawdown_duration': drawdown_duration(values)
+    }, index=labels)
+
+
+class RunningMetrics:
+    """
+    The metrics of the functions above, kept up to date one period at a time, for every column at once. Appending
+    a candle costs a few array operations over the columns instead of recomputing the whole history, and gives the
+    same results as the functions over the history seen so far.
+    """
+
+    def __init__(self, n_series: int, risk_free: float = 0.0, periods_per_year: int = 12, window: int | None = None):
+        """
+        :param window: also track the return over this many periods, see :func:`rolling_returns`
+        """
+        self.risk_free = risk_free
+        self.periods_per_year = periods_per_year
+        self.window = window
+        self.periods = 0
+        self.first = np.full(n_series, np.nan)
+        self.first_period = np.full(n_series, -1)
+        self.last = np.full(n_series, np.nan)
+        self.last_period = np.full(n_series, -1)
+        self.peak = np.full(n_series, np.nan)
+        self.max_drawdown = np.full(n_series, np.nan)
+        self.underwater = np.zeros(n_series, dtype=np.int64)
+        self.drawdown_duration = np.zeros(n_series, dtype=np.int64)
+        # Welford's running mean and sum of squared deviations of the excess returns, plus their downside
+        self.count = np.zeros(n_series, dtype=np.int64)
+        self.mean = np.zeros(n_series)
+        self.squares = np.zeros(n_series)
+        self.downside_squares = np.zeros(n_series)
+        self._recent = np.full((window + 1, n_series), np.nan) if window is not None else None
+
+    def update(self, row: np.ndarray):
+        """Add the values of every column at the next period."""
+        row = np.asarray(row, dtype=np.float64)
+        valid = ~np.isnan(row)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            excess = row / self.last - 1 - self.risk_free / self.periods_per_year
+        counted = valid & ~np.isnan(self.last)
+        self.count += counted
+        delta = np.where(counted, excess - self.mean, 0.0)
+        self.mean += np.where(counted, delta / np.maximum(self.count, 1), 0.0)
+        self.squares += np.where(counted, delta * (excess - self.mean), 0.0)
+        self.downside_squares += np.where(counted, np.minimum(excess, 0) ** 2, 0.0)
+
+        new = valid & (self.first_period < 0)
+        self.first = np.where(new, row, self.first)
+        self.first_period = np.where(new, self.periods, self.first_period)
+        self.last = np.where(valid, row, self.last)
+        self.last_period = np.where(valid, self.periods, self.last_period)
+
+        self.peak = np.fmax(self.peak, row)
+        self.max_drawdown = np.fmin(self.max_drawdown, row / self.peak - 1)
+        below = valid & (row < self.peak)
+        self.underwater = np.where(below, self.underwater + 1, np.where(valid, 0, self.underwater))
+        self.drawdown_duration = np.maximum(self.drawdown_duration, self.underwater)
+
+        if self._recent is not None:
+            self._recent = np.roll(self._recent, -1, axis=0)
+            self._recent[-1] = row
+        self.periods += 1
+
+    def extend(self, values: np.ndarray):
+        for row in _columns(values):
+            self.update(row)
+
+    def cagr(self) -> np.ndarray:
+        years = (self.last_period - self.first_period) / self.periods_per_year
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(years > 0, (self.last / self.first) ** (1 / years) - 1, np.nan)
+
+    def volatility(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.count > 1, np.sqrt(self.squares / (self.count - 1) * self.periods_per_year), np.nan)
+
+    def sharpe(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            deviation = np.sqrt(self.squares / (self.count - 1))
+            return np.where(self.count > 1, self.mean / deviation * np.sqrt(self.periods_per_year), np.nan)
+
+    def sortino(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            downside = np.sqrt(self.downside_squares / self.count)
+            return np.where(self.count > 1, self.mean / downside * np.sqrt(self.periods_per_year), np.nan)
+
+    def rolling_return(self) -> np.ndarray:
+        """Return over the last ``window`` periods, NaN until that many periods were added."""
+        if self._recent is None:
+            raise ValueError("No window to track rolling returns over")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self._recent[-1] / self._recent[0] - 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank the stored universe by risk-adjusted return")
+    parser.add_argument("--store", default="/home/ruben/Projects/finfacts/cache/panel-int_1mo")
+    parser.add_argument("--interval", default="1mo", choices=PERIODS_PER_YEAR)
+    parser.add_argument("--risk-free", type=float, default=0.0, help="annual risk-free rate")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    panel = PriceStore(args.store).load()
+    metrics = summary(panel["Close"], panel.isins, args.risk_free, PERIODS_PER_YEAR[args.interval])
+    print(metrics.sort_values("sharpe", ascending=False).head(args.top).to_string())
@@ -0,0 +1,160 @@
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import StockDataDB
+from refresh import CheckpointJournal
+from stock_metadata import StockMetadata
+
+
+class MetadataPipeline:
+    """
+    Concurrent metadata ingestion: a bounded pool of fetch workers shares the data source (for Yahoo, the rate
+    limited and cached session) of a :class:`StockMetadata` and feeds a queue, which a single writer thread drains
+    into one long-lived database connection in batches. Cache hits no longer wait behind network calls, and the
+    database sees one commit per batch instead of one per row.
+    """
+
+    _DONE = object()
+
+    def __init__(self, stock_metadata: StockMetadata | None = None, db_path: str = 'finfacts.db',
+                 concurrency: int = 4, batch_size: int = 5000, flush_seconds: float = 30.0, queue_size: int = 256,
+                 journal: CheckpointJournal | None = None, report: bool = True, delta: bool = False):
+        """
+        :param stock_metadata: fetcher to share between the workers, a new one when None
+        :param db_path: database the writer thread opens
+        :param concurrency: number of fetch workers
+        :param batch_size: rows the writer buffers before it commits, at the end of the record that reaches it
+        :param flush_seconds: also commit buffered records this long after the previous commit, so the journal of a
+            slow, rate limited run keeps up
+        :param queue_size: fetched records that may wait for the writer before workers block
+        :param journal: checkpoint journal that committed and failed ISINs are recorded in
+        :param report: print the per-stage report of ``stock_metadata.instrumentation`` after the run
+        :param delta: only store snapshots whose values changed, see ``StockDataDB(delta=True)``
+        """
+        self.stock_metadata = stock_metadata if stock_metadata is not None else StockMetadata()
+        self.instrumentation = self.stock_metadata.instrumentation
+        self.report = report
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.journal = journal
+        self.delta = delta
+        self._records: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.failures: dict[str, str] = {}
+        self.rows_written = 0
+        self.isins_written = 0
+
+    def run(self, isins: list[str]) -> dict:
+        """Fetch and store metadata for all ``isins``, returns the throughput summary that is also printed."""
+        start = time.perf_counter()
+        # Fail here when the database can't be opened (or migrated), before any worker is waiting on the writer
+        StockDataDB(path=self.db_path, wal=True).connection.close()
+        writer = threading.Thread(target=self._write_records, name="metadata-writer")
+        writer.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="metadata-fetch") as executor:
+                for isin in isins:
+                    executor.submit(self._fetch, isin)
+        finally:
+            self._records.put(self._DONE)
+            writer.join()
+        summary = {
+            'isins': len(isins),
+            'stored': self.isins_written,
+            'failed': len(self.failures),
+            'rows': self.rows_written,
+            'concurrency': self.concurrency,
+            'seconds': time.perf_counter() - start
+        }
+        self._print_summary(summary)
+        if self.report:
+            print(self.instrumentation.report())
+        return summary
+
+    def _fetch(self, isin: str):
+        print(f"Fetching metadata for {isin}")
+        try:
+            record = self.stock_metadata.fetch_metadata(isin)
+        except Exception as e:
+            print(f"Exception occurred for {isin}: {e}")
+            self.failures[isin] = repr(e)
+            self.instrumentation.failure(isin, "fetch", e)
+            if self.journal is not None:
+                self.journal.mark_failed(isin, repr(e))
+            return
+        # Time spent here means the writer is the bottleneck
+        with self.instrumentation.timer("pipeline.queue_wait"):
+            self._records.put(record)
+
+    def _write_records(self):
+        database = None
+        # ISIN and number of rows of every record written since the last commit
+        uncommitted: list[tuple[str, int]] = []
+        done = False
+        try:
+            # SQLite connections are bound to the thread that opens them, so the writer opens its own
+            database = StockDataDB(path=self.db_path, wal=True, synchronous="NORMAL",
+                                   instrumentation=self.instrumentation, delta=self.delta)
+            # Only commit between records, so every commit covers whole ISINs and can be checkpointed
+            with database.batch(size=sys.maxsize):
+                last_commit = time.monotonic()
+                while not done:
+                    timeout = max(0.0, last_commit + self.flush_seconds - time.monotonic()) if uncommitted else None
+                    try:
+                        record = self._records.get(timeout=timeout)
+                    except queue.Empty:
+                        record = None
+                    done = record is self._DONE
+                    if record is not None and not done:
+                        uncommitted.append((record['metadata']['isin'],
+                                            StockMetadata.write_metadata(database, record)))
+                    if uncommitted and (done or database.pending_rows >= self.batch_size
+                                        or time.monotonic() - last_commit >= self.flush_seconds):
+                        self._commit(database, uncommitted)
+                        last_commit = time.monotonic()
+        except Exception as e:
+            print(f"Writer stopped: {e}")
+            for isin, _ in uncommitted:
+                self._not_written(isin, e)
+            # Keep draining so the fetch workers don't block on a full queue, unless they are all done already
+            while not done:
+                record = self._records.get()
+                done = record is self._DONE
+                if not done:
+                    self._not_written(record['metadata']['isin'], e)
+        finally:
+            if database is not None:
+                database.connection.close()
+
+    def _commit(self, database: StockDataDB, uncommitted: list[tuple[str, int]]):
+        """Commit the buffered records and checkpoint the ISINs the database took all rows of."""
+        rejected = database.flush()
+        written = [(isin, rows) for isin, rows in uncommitted if isin not in rejected]
+        for isin in rejected:
+            self.failures[isin] = "rows rejected by the database"
+            if self.journal is not None:
+                self.journal.mark_failed(isin, "rows rejected by the database")
+        self.isins_written += len(written)
+        self.rows_written += sum(rows for _, rows in written)
+        if self.journal is not None:
+            self.journal.mark_done([isin for isin, _ in written])
+        uncommitted.clear()
+
+    def _not_written(self, isin: str, error: Exception):
+        self.failures[isin] = f"not written: {error!r}"
+        self.instrumentation.failure(isin, "write", error)
+        if self.journal is not None:
+            self.journal.mark_failed(isin, f"not written: {error!r}")
+
+    @classmethod
+    def _print_summary(cls, summary: dict):
+        seconds = summary['seconds']
+        print(f"Stored metadata for {summary['stored']}/{summary['isins']} ISINs "
+              f"({summary['failed']} failed, {summary['rows']} rows) in {seconds:.1f}s "
+              f"with {summary['concurrency']} workers")
+        if seconds > 0:
+            print(f"  {summary['stored'] / seconds:.2f} ISINs/sec, {summary['rows'] / seconds:.0f} rows/sec")
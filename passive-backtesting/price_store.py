@@ -0,0 +1,212 @@
+import argparse
+import glob
+import json
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+
+class PricePanel:
+    """
+    Candles of many ISINs aligned on one date axis: every field is a ``dates x isins`` float64 array, with NaN where
+    an ISIN has no candle (before its listing, after its delisting or in a gap), and ``valid`` flags where it has.
+    """
+
+    FIELDS = ("Open", "High", "Low", "Close", "Volume", "Dividends", "Stock Splits")
+
+    def __init__(self, dates: np.ndarray, isins: list[str], fields: dict[str, np.ndarray],
+                 valid: np.ndarray | None = None):
+        self.dates = dates
+        self.isins = list(isins)
+        self.fields = fields
+        self.valid = valid if valid is not None else ~np.isnan(fields["Close"])
+        self._columns = {isin: column for column, isin in enumerate(self.isins)}
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.fields[field]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.dates), len(self.isins)
+
+    def column(self, isin: str) -> int:
+        return self._columns[isin]
+
+    def series(self, isin: str, field: str = "Close") -> np.ndarray:
+        return self.fields[field][:, self._columns[isin]]
+
+    def frame(self, isin: str) -> pd.DataFrame:
+        """The valid candles of ``isin`` as a history frame, the inverse of :meth:`from_frames`."""
+        column = self._columns[isin]
+        valid = self.valid[:, column]
+        return pd.DataFrame({field: values[valid, column] for field, values in self.fields.items()},
+                            index=pd.DatetimeIndex(self.dates[valid], name="Date"))
+
+    def listing_range(self) -> tuple[np.ndarray, np.ndarray]:
+        """Per ISIN, the row of its first and one past its last valid candle (both 0 when it has none)."""
+        any_valid = self.valid.any(axis=0)
+        first = np.where(any_valid, self.valid.argmax(axis=0), 0)
+        last = np.where(any_valid, len(self.dates) - self.valid[::-1].argmax(axis=0), 0)
+        return first, last
+
+    @classmethod
+    def from_frames(cls, frames: dict[str, pd.DataFrame]) -> "PricePanel":
+        """Align yfinance history frames (indexed by date, one per ISIN) on the union of their dates."""
+        isins = sorted(frames)
+        dates = pd.DatetimeIndex([])
+        for frame in frames.values():
+            dates = dates.union(frame.index)
+        fields = {}
+        for field in cls.FIELDS:
+            columns = {isin: frames[isin][field] for isin in isins if field in frames[isin]}
+            panel = pd.concat(columns, axis=1) if columns else pd.DataFrame(index=dates)
+            fields[field] = panel.reindex(index=dates, columns=isins).to_numpy(dtype=np.float64)
+        return cls(dates.to_numpy(dtype="datetime64[D]"), isins, fields)
+
+
+class PriceStore:
+    """
+    Binary columnar store for a :class:`PricePanel`: one ``.npy`` file per field plus the date axis, the validity
+    mask and a JSON manifest. Loading memory-maps the arrays, so even the whole universe opens instantly and pages
+    are only read when a strategy touches them.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name.lower().replace(" ", "_") + ".npy")
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, "manifest.json"))
+
+    def save_array(self, name: str, array: np.ndarray):
+        """Store ``array`` as ``name`` in the directory, e.g. a field or an index derived from the panel."""
+        # Write next to the target and swap it in, so readers never map a half-written file
+        temporary = self._path(name) + ".tmp"
+        with open(temporary, 'wb') as file:
+            np.save(file, np.ascontiguousarray(array))
+        os.replace(temporary, self._path(name))
+
+    def save(self, panel: PricePanel):
+        os.makedirs(self.directory, exist_ok=True)
+        for name, array in dict(panel.fields, dates=panel.dates, valid=panel.valid).items():
+            self.save_array(name, array)
+        self._save_manifest(panel.isins, list(panel.fields), panel.shape)
+
+    def _save_manifest(self, isins: list[str], fields: list[str], shape: tuple[int, int]):
+        manifest = {
+            'isins': isins,
+            'fields': fields,
+            'shape': list(shape)
+        }
+        temporary = os.path.join(self.directory, "manifest.json.tmp")
+        with open(temporary, 'w') as file:
+            # noinspection PyTypeChecker
+            json.dump(manifest, file, indent=4)
+        os.replace(temporary, os.path.join(self.directory, "manifest.json"))
+
+    @contextmanager
+    def writer(self, dates: np.ndarray, isins: list[str], fields: tuple[str, ...] = PricePanel.FIELDS,
+               chunk_rows: int = 4096) -> Iterator[PricePanel]:
+        """
+        Build a panel too large for memory in place: yields a panel of NaN-filled, writable memory maps to fill
+        (e.g. a block of ISINs at a time), and on exit derives the validity mask from Close and swaps the files in.
+        Only ``chunk_rows`` rows are filled or scanned at once.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        shape = (len(dates), len(isins))
+        names = list(fields) + ["valid"]
+        arrays = {name: np.lib.format.open_memmap(self._path(name) + ".tmp", mode='w+',
+                                                  dtype=bool if name == "valid" else np.float64, shape=shape)
+                  for name in names}
+        try:
+            for start in range(0, shape[0], chunk_rows):
+                for field in fields:
+                    arrays[field][start:start + chunk_rows] = np.nan
+            yield PricePanel(dates, isins, {field: arrays[field] for field in fields}, arrays["valid"])
+            for start in range(0, shape[0], chunk_rows):
+                arrays["valid"][start:start + chunk_rows] = ~np.isnan(arrays["Close"][start:start + chunk_rows])
+            for name in names:
+                arrays[name].flush()
+        except BaseException:
+            for name in names:
+                os.remove(self._path(name) + ".tmp")
+            raise
+        for name in names:
+            os.replace(self._path(name) + ".tmp", self._path(name))
+        self.save_array("dates", dates)
+        self._save_manifest(list(isins), list(fields), shape)
+
+    def rows(self, field: str, start: int, stop: int) -> np.ndarray:
+        """
+        A copy of rows ``start:stop`` of ``field``. The map it is read through is dropped again, so walking the
+        whole store in chunks keeps only one chunk resident.
+        """
+        mapped = np.load(self._path(field), mmap_mode='r')
+        chunk = np.array(mapped[start:stop])
+        del mapped
+        return chunk
+
+    def load(self, mmap_mode: str | None = 'r') -> PricePanel:
+        """Open the stored panel, memory-mapped read-only by default (``mmap_mode=None`` reads it into memory)."""
+        with open(os.path.join(self.directory, "manifest.json"), 'r') as file:
+            manifest = json.load(file)
+        fields = {field: np.load(self._path(field), mmap_mode=mmap_mode) for field in manifest['fields']}
+        return PricePanel(np.load(self._path("dates"), mmap_mode=mmap_mode), manifest['isins'], fields,
+                          np.load(self._path("valid"), mmap_mode=mmap_mode))
+
+
+def read_candles_csv(path: str) -> pd.DataFrame:
+    """Read a history CSV written by ``history.py``, indexed by the (timezone-free) candle date."""
+    frame = pd.read_csv(path, index_col="Date")
+    # Keep the exchange-local date, converting to UTC would move e.g. +01:00 month starts to the previous day
+    frame.index = pd.to_datetime(frame.index.str[:10])
+    return frame
+
+
+def import_csv_cache(cache_path: str, store: PriceStore, interval: str = "1mo", block: int = 256) -> PricePanel:
+    """
+    Build the panel for ``interval`` from the per-ISIN CSV cache of ``history.py`` and save it in ``store``. The
+    date axis is collected first, then the panel is written ``block`` ISINs at a time through
+    :meth:`PriceStore.writer`, so even decades of daily candles never have to fit in memory at once.
+    """
+    suffix = f"-p_max-int_{interval}.csv"
+    paths, dates = {}, np.array([], dtype="datetime64[D]")
+    for path in sorted(glob.glob(os.path.join(cache_path, f"*{suffix}"))):
+        isin = os.path.basename(path)[:-len(suffix)]
+        try:
+            candle_dates = pd.read_csv(path, usecols=["Date"])["Date"].str[:10].to_numpy(dtype="datetime64[D]")
+        except Exception as e:
+            print(f"Exception occurred for {isin}: {e}")
+            continue
+        paths[isin] = path
+        dates = np.union1d(dates, candle_dates)
+
+    isins = sorted(paths)
+    with store.writer(dates, isins) as panel:
+        for start in range(0, len(isins), block):
+            block_isins = isins[start:start + block]
+            columns = {field: np.full((len(dates), len(block_isins)), np.nan) for field in PricePanel.FIELDS}
+            for column, isin in enumerate(block_isins):
+                frame = read_candles_csv(paths[isin])
+                rows = np.searchsorted(dates, frame.index.to_numpy(dtype="datetime64[D]"))
+                for field in PricePanel.FIELDS:
+                    if field in frame:
+                        columns[field][rows, column] = frame[field].to_numpy(dtype=np.float64)
+            for field in PricePanel.FIELDS:
+                panel[field][:, start:start + len(block_isins)] = columns[field]
+    print(f"Imported {len(isins)} ISINs x {len(dates)} candles into {store.directory}")
+    return store.load()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import the per-ISIN candle CSVs into a columnar price store")
+    parser.add_argument("--cache", default="/home/ruben/Projects/finfacts/cache/")
+    parser.add_argument("--store", default="/home/ruben/Projects/finfacts/cache/panel-int_1mo")
+    parser.add_argument("--interval", default="1mo")
+    args = parser.parse_args()
+    import_csv_cache(args.cache, PriceStore(args.store), args.interval)
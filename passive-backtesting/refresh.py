@@ -0,0 +1,84 @@
+import os
+from datetime import date as Date, datetime, timedelta
+
+from database import StockDataDB
+
+
+class CheckpointJournal:
+    """
+    Append-only record of the ISINs a refresh run has committed, so an interrupted run can resume where it stopped.
+    The first line holds the target date of the run, a journal written for another date is started over.
+    """
+
+    def __init__(self, path: str, target_date: Date | str):
+        self.path = path
+        self.target_date = StockDataDB.date_string(target_date)
+        if not self._matches_target():
+            with open(self.path, 'w') as file:
+                file.write(f"target {self.target_date}\n")
+        self._done = self._load()
+
+    def _matches_target(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r') as file:
+            return file.readline().strip() == f"target {self.target_date}"
+
+    def _load(self) -> set[str]:
+        with open(self.path, 'r') as file:
+            lines = file.read().splitlines()[1:]
+        return {line.split(" ", 1)[1] for line in lines if line.startswith("done ")}
+
+    def done(self) -> set[str]:
+        return set(self._done)
+
+    def mark_done(self, isins: list[str]):
+        """Record committed ISINs, flushed to disk before returning."""
+        if not isins:
+            return
+        with open(self.path, 'a') as file:
+            file.writelines(f"done {isin}\n" for isin in isins)
+            file.flush()
+            os.fsync(file.fileno())
+        self._done.update(isins)
+
+    def mark_failed(self, isin: str, reason: str):
+        """Failures are only logged, a resumed run tries them again."""
+        with open(self.path, 'a') as file:
+            file.write(f"failed {isin} {reason}\n")
+
+
+class RefreshPlanner:
+    """
+    Decides which ISINs an incremental refresh has to fetch, from the snapshot dates and metadata already in the
+    database plus the checkpoint journal of an earlier, interrupted run for the same target date.
+    """
+
+    def __init__(self, database: StockDataDB, max_age_days: int = 0, journal: CheckpointJournal | None = None):
+        """
+        :param max_age_days: snapshots at most this many days older than the target date count as fresh
+        :param journal: journal of the current run, ISINs it lists as done are skipped
+        """
+        self.database = database
+        self.max_age_days = max_age_days
+        self.journal = journal
+
+    def plan(self, isins: list[str], target_date: Date | str | None = None) -> list[str]:
+        """
+        The stale or missing ISINs among ``isins``, in their original order. ISINs without metadata count as missing,
+        their snapshots may have been stored while their metadata was rejected.
+        """
+        if target_date is None:
+            target_date = datetime.today()
+        if isinstance(target_date, str):
+            target_date = datetime.strptime(target_date, StockDataDB.DATE_FORMAT)
+        fresh_from = StockDataDB.date_string(target_date - timedelta(days=self.max_age_days))
+
+        latest = self.database.get_latest_snapshot_dates()
+        described = self.database.get_currencies()
+        done = self.journal.done() if self.journal is not None else set()
+        stale = [isin for isin in isins
+                 if isin not in done and (isin not in described or latest.get(isin, "") < fresh_from)]
+        print(f"Refresh plan: {len(stale)} of {len(isins)} ISINs are stale or missing "
+              f"({len(isins) - len(stale)} fresh since {fresh_from})")
+        return stale
@@ -0,0 +1,165 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from typing import Callable
+
+import numpy as np
+
+
+def data_fingerprint(*paths: str | None) -> str:
+    """
+    Version of the data behind ``paths`` (price store directories, database files, ...): a hash of the size and
+    modification time of every file in them, so it changes whenever ingestion rewrites any of them. A SQLite
+    database's write-ahead log is included with it. Missing paths and None are skipped.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if path is None:
+            continue
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            files = [path, path + "-wal"]
+        for file in files:
+            if os.path.isfile(file):
+                stat = os.stat(file)
+                digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def data_source(*paths: str | None) -> str:
+    """Which data ``paths`` are, as opposed to which version of it (see :func:`data_fingerprint`). None is skipped."""
+    encoded = "\n".join(os.path.abspath(path) for path in paths if path is not None)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Simulation outputs on disk, addressed by a hash of the parameters that produced them. Entries live in a
+    directory per data source and fingerprint under :data:`SUBDIRECTORY`, and opening the cache with a new
+    fingerprint deletes the directories of the old fingerprints of the same source, so results computed on outdated
+    data are never returned while other sources sharing the directory keep theirs. Only directories holding the
+    :data:`MARKER` file are ever deleted. Every entry is a compressed ``.npz`` of named arrays. When the cache
+    outgrows ``max_bytes``, the least recently used entries are evicted.
+    """
+
+    SUBDIRECTORY = "results"
+    '''where the source directories, each holding its fingerprint directories, are kept in the cache directory'''
+
+    MARKER = ".result_cache"
+    '''file in every fingerprint directory the cache created, the only directories it ever deletes'''
+
+    def __init__(self, directory: str, source: str, fingerprint: str, max_bytes: int = 1 << 30):
+        """
+        :param directory: where the entries are kept, shared by all sources and fingerprints
+        :param source: which input data the results are computed on, see :func:`data_source`
+        :param fingerprint: version of the input data, see :func:`data_fingerprint`
+        :param max_bytes: total size of the entries the cache is trimmed back to
+        """
+        root = os.path.join(directory, self.SUBDIRECTORY, source)
+        self.directory = os.path.join(root, fingerprint)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        open(os.path.join(self.directory, self.MARKER), 'a').close()
+        for name in self.fingerprint_directories(directory, source):
+            if name != fingerprint:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    @classmethod
+    def sources(cls, directory: str) -> list[str]:
+        """The data sources with a cache in ``directory``."""
+        root = os.path.join(directory, cls.SUBDIRECTORY)
+        if not os.path.isdir(root):
+            return []
+        return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+    @classmethod
+    def fingerprint_directories(cls, directory: str, source: str) -> list[str]:
+        """Names of the fingerprint directories the cache created in ``directory`` for ``source``."""
+        root = os.path.join(directory, cls.SUBDIRECTORY, source)
+        if not os.path.isdir(root):
+            return []
+        return sorted(name for name in os.listdir(root) if os.path.isfile(os.path.join(root, name, cls.MARKER)))
+
+    def _entries(self) -> list[os.DirEntry]:
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".npz")]
+
+    @classmethod
+    def key(cls, params: dict) -> str:
+        encoded = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def _path(self, params: dict) -> str:
+        return os.path.join(self.directory, self.key(params) + ".npz")
+
+    def get(self, params: dict) -> dict[str, np.ndarray] | None:
+        """The arrays stored for ``params``, or None when they aren't cached."""
+        path = self._path(params)
+        try:
+            with np.load(path) as entry:
+                arrays = dict(entry)
+        except (FileNotFoundError, OSError, ValueError):
+            self.misses += 1
+            return None
+        # The modification time doubles as the last use, for eviction
+        os.utime(path)
+        self.hits += 1
+        return arrays
+
+    def put(self, params: dict, arrays: dict[str, np.ndarray]):
+        path = self._path(params)
+        temporary = path + ".tmp"
+        with open(temporary, 'wb') as file:
+            np.savez_compressed(file, **arrays)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(temporary, path)
+        self._size += os.path.getsize(path) - previous
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def cached(self, params: dict, compute: Callable[[], dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+        """The arrays stored for ``params``, computed and stored first when they aren't cached."""
+        arrays = self.get(params)
+        if arrays is None:
+            arrays = compute()
+            self.put(params, arrays)
+        return arrays
+
+    def evict(self):
+        """Delete the least recently used entries until the cache is at most 90% of ``max_bytes``."""
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime_ns)
+        self._size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            self._size -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def clear(self):
+        for entry in self._entries():
+            os.remove(entry.path)
+        self._size = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or clear a simulation result cache")
+    parser.add_argument("directory")
+    parser.add_argument("--clear", action="store_true", help="delete every entry, of all sources and fingerprints")
+    args = parser.parse_args()
+
+    for source in ResultCache.sources(args.directory):
+        for fingerprint_directory in ResultCache.fingerprint_directories(args.directory, source):
+            path_of_fingerprint = os.path.join(args.directory, ResultCache.SUBDIRECTORY, source, fingerprint_directory)
+            sizes = [entry.stat().st_size for entry in os.scandir(path_of_fingerprint) if entry.name.endswith(".npz")]
+            print(f"{source}/{fingerprint_directory}: {len(sizes)} entries, {sum(sizes) / 1e6:.1f} MB")
+            if args.clear:
+                shutil.rmtree(path_of_fingerprint)
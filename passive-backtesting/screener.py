@@ -0,0 +1,125 @@
+import argparse
+from collections import OrderedDict
+from datetime import date as Date
+
+import numpy as np
+import pandas as pd
+
+from database import StockDataDB
+
+Filter = tuple[str, str, float]
+'''field, operator and value, e.g. ``("trailingPE", "<", 15)``'''
+
+
+class Screener:
+    """
+    Filters and ranks the universe on its fundamentals as of a date. Every as-of cross-section of ABSOLUTES and
+    RATIOS is read once into a float64 frame with one column per field, and kept for later screens on the same date,
+    so the filters and ranks of a rebalance schedule are evaluated on whole columns instead of per ISIN.
+    """
+
+    FIELDS = StockDataDB.ABSOLUTES_FIELDS + StockDataDB.RATIOS_FIELDS
+
+    OPERATORS = {
+        '<': np.less,
+        '<=': np.less_equal,
+        '>': np.greater,
+        '>=': np.greater_equal,
+        '==': np.equal,
+        '!=': np.not_equal
+    }
+
+    def __init__(self, database: StockDataDB, isins: list[str] | None = None, cache_size: int = 512):
+        """
+        :param database: where the snapshots are read from
+        :param isins: universe to screen, every ISIN with snapshots when None
+        :param cache_size: cross-sections kept in memory, the least recently used one is dropped beyond that
+        """
+        self.database = database
+        self.isins = isins
+        self.cache_size = cache_size
+        self._cross_sections: OrderedDict[str, pd.DataFrame] = OrderedDict()
+
+    def cross_section(self, as_of: Date | str) -> pd.DataFrame:
+        """
+        Latest absolutes and ratios on or before ``as_of`` for every ISIN with either, indexed by ISIN with one
+        float64 column per field in :data:`FIELDS` (NaN where a value or a whole snapshot is missing).
+        """
+        as_of = StockDataDB.date_string(as_of)
+        if as_of in self._cross_sections:
+            self._cross_sections.move_to_end(as_of)
+            return self._cross_sections[as_of]
+        absolutes = self.database.get_absolutes_as_of(as_of, self.isins).drop(columns="date")
+        ratios = self.database.get_ratios_as_of(as_of, self.isins).drop(columns="date")
+        cross_section = absolutes.join(ratios, how="outer").reindex(columns=list(self.FIELDS))
+        self._cross_sections[as_of] = cross_section
+        if len(self._cross_sections) > self.cache_size:
+            self._cross_sections.popitem(last=False)
+        return cross_section
+
+    def mask(self, as_of: Date | str, filters: list[Filter]) -> tuple[pd.Index, np.ndarray]:
+        """ISINs of the cross-section as of ``as_of`` and which of them pass all ``filters``, missing values fail."""
+        cross_section = self.cross_section(as_of)
+        passed = np.ones(len(cross_section), dtype=bool)
+        for field, operator, value in filters:
+            if field not in self.FIELDS:
+                raise ValueError(f"Unknown field: {field}")
+            if operator not in self.OPERATORS:
+                raise ValueError(f"Unknown operator: {operator}")
+            passed &= self.OPERATORS[operator](cross_section[field].to_numpy(), value)
+        return cross_section.index, passed
+
+    def screen(self, as_of: Date | str, filters: list[Filter] = (), rank_by: str | None = None,
+               top: int | None = None, ascending: bool = False) -> list[str]:
+        """
+        ISINs passing all ``filters`` as of ``as_of``, ordered by ISIN, or when ``rank_by`` is given, the ``top``
+        of them (all when None) ordered by that field. ISINs missing the ranked field are left out of a ranking.
+
+        :param ascending: rank the lowest values first, e.g. for "low P/E", instead of the highest
+        """
+        isins, passed = self.mask(as_of, filters)
+        if rank_by is None:
+            return isins[passed].tolist()
+        if rank_by not in self.FIELDS:
+            raise ValueError(f"Unknown field: {rank_by}")
+        values = self.cross_section(as_of)[rank_by].to_numpy()
+        candidates = np.flatnonzero(passed & ~np.isnan(values))
+        keys = values[candidates] if ascending else -values[candidates]
+        if top is not None and top < len(candidates):
+            # Only the top N need sorting
+            best = np.argpartition(keys, top - 1)[:top]
+            candidates, keys = candidates[best], keys[best]
+        return isins[candidates[np.argsort(keys, kind="stable")]].tolist()
+
+    def rebalance_schedule(self, dates: list[Date | str], filters: list[Filter] = (), rank_by: str | None = None,
+                           top: int | None = None, ascending: bool = False) -> dict[str, list[str]]:
+        """The :meth:`screen` result for every rebalance date, keyed by ISO date."""
+        return {StockDataDB.date_string(date): self.screen(date, filters, rank_by, top, ascending) for date in dates}
+
+
+def parse_filter(text: str) -> Filter:
+    """``"trailingPE<15"`` -> ``("trailingPE", "<", 15.0)``"""
+    for operator in sorted(Screener.OPERATORS, key=len, reverse=True):
+        field, found, value = text.partition(operator)
+        if found:
+            return field.strip(), operator, float(value)
+    raise ValueError(f"No operator in filter: {text}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screen the stored universe on its fundamentals")
+    parser.add_argument("as_of", nargs="+", help="dates to screen on, as yyyy-mm-dd")
+    parser.add_argument("--filter", dest="filters", action="append", type=parse_filter, default=[],
+                        help='e.g. "trailingPE<15", can be repeated')
+    parser.add_argument("--rank-by", help="field to rank the ISINs that pass the filters by")
+    parser.add_argument("--top", type=int, help="number of ranked ISINs to keep")
+    parser.add_argument("--ascending", action="store_true", help="rank the lowest values first")
+    args = parser.parse_args()
+
+    screener = Screener(StockDataDB())
+    for screen_date, selection in screener.rebalance_schedule(args.as_of, args.filters, args.rank_by, args.top,
+                                                              args.ascending).items():
+        print(f"{screen_date}: {len(selection)} ISINs")
+        for selected in selection:
+            print(f"  {selected}")
+    screener.database.connection.close()
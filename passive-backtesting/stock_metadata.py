@@ -1,80 +1,110 @@
 import yfinance as yf
 
-from requests import Session
-from requests_cache import CacheMixin, SQLiteCache
-from requests_ratelimiter import LimiterMixin, MemoryQueueBucket
-from pyrate_limiter import Duration, RequestRate, Limiter
-
 from datetime import datetime
+from data_source import DataSource, LiveDataSource
 from database import StockDataDB
-
-
-class CachedLimiterSession(CacheMixin, LimiterMixin, Session):
-    pass
+from instrumentation import Instrumentation
 
 
 class StockMetadata:
-
-    def __init__(self):
-        self.session = CachedLimiterSession(
-            limiter=Limiter(RequestRate(1, Duration.SECOND * 5)),
-            bucket_class=MemoryQueueBucket,
-            backend=SQLiteCache("yfinance.cache")
-        )
+    REQUIRED_INFO = ("symbol", "shortName", "currency", "exchange", "firstTradeDateEpochUtc")
+    '''``info`` keys the META columns are filled from, none of which can be NULL'''
+
+    def __init__(self, database: StockDataDB | None = None, data_source: DataSource | None = None,
+                 instrumentation: Instrumentation | None = None):
+        """
+        :param database: long-lived database to write into (e.g. inside a ``StockDataDB.batch()``), when None every
+            ``store_metadata`` call opens and closes its own connection
+        :param data_source: where ``info`` and ``calendar`` come from, Yahoo Finance when None
+        :param instrumentation: collects the time spent per stage, a new one when None
+        """
+        self.database = database
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.data_source = data_source if data_source is not None else LiveDataSource(
+            instrumentation=self.instrumentation)
 
     def store_metadata(self, isin: str):
         print(f"Storing metadata for {isin}")
-        date_string = datetime.today().strftime("%d_%m_%Y")
-        ticker = yf.Ticker(isin, session=self.session)
-        database = StockDataDB()
-
-        info = ticker.info
-        calendar = ticker.calendar
-
-        database.add_metadata(isin=isin,
-                              symbol=info['symbol'],
-                              name=info['shortName'].replace("'", " "),
-                              currency=info['currency'],
-                              exchange=info['exchange'],
-                              first_trade_date=datetime.fromtimestamp(
-                                  info['firstTradeDateEpochUtc']).strftime("%d_%m_%Y"))
-
-        database.add_absolutes(isin=isin,
-                               date=date_string,
-                               market_cap=info.get('marketCap',None),
-                               enterprise_value=info.get('enterpriseValue',None),
-                               average_volume=info.get('averageVolume',None),
-                               average_volume_10days=info.get('averageVolume10days',None))
-
-        database.add_ratios(isin=isin,
-                            date=date_string,
-                            beta=info.get('beta',None),
-                            trailing_pe=info.get('trailingPE',None),
-                            forward_pe=info.get('forwardPE',None),
-                            price_to_book=info.get('priceToBook',None),
-                            trailing_eps=info.get('trailingEps',None),
-                            forward_eps=info.get('forwardEps',None),
-                            enterprise_to_revenue=info.get('enterpriseToRevenue',None),
-                            enterprise_to_ebitda=info.get('enterpriseToEbitda',None))
-
+        try:
+            record = self.fetch_metadata(isin)
+        except Exception as e:
+            self.instrumentation.failure(isin, "fetch", e)
+            raise
+        database = self.database if self.database is not None else StockDataDB(instrumentation=self.instrumentation)
+        self.write_metadata(database, record)
+        if self.database is None:
+            database.connection.close()
+
+    def fetch_metadata(self, isin: str) -> dict:
+        """
+        Download ``info`` and ``calendar`` for ``isin`` and shape them into the ``add_*`` keyword arguments of
+        :class:`StockDataDB`, without touching the database. Safe to call from several threads at once, they share
+        the data source and with it the cache and the rate limiter.
+        """
+        date_string = StockDataDB.date_string(datetime.today())
+
+        with self.instrumentation.timer("fetch.info"):
+            info = self.data_source.info(isin)
+        missing = [key for key in self.REQUIRED_INFO if info.get(key) is None]
+        if missing:
+            raise ValueError(f"No {', '.join(missing)} in the info of {isin}")
+        with self.instrumentation.timer("fetch.calendar"):
+            calendar = self.data_source.calendar(isin)
+
+        events = []
         ex_dividend_date: datetime | None = calendar.get('Ex-Dividend Date',None)
         if ex_dividend_date:
-            database.add_event(isin=isin, date=ex_dividend_date.strftime("%d_%m_%Y"), event_type="Ex-Dividend")
+            events.append(dict(isin=isin, date=StockDataDB.date_string(ex_dividend_date), event_type="Ex-Dividend"))
         dividend_date: datetime | None = calendar.get('Dividend Date',None)
         if dividend_date:
-            database.add_event(isin=isin, date=dividend_date.strftime("%d_%m_%Y"), event_type="Dividend")
+            events.append(dict(isin=isin, date=StockDataDB.date_string(dividend_date), event_type="Dividend"))
 
         earnings: list[datetime] | None = calendar.get('Earnings Date',None)
         if earnings:
             for date in earnings:
-                database.add_event(isin=isin, date=date.strftime("%d_%m_%Y"), event_type="Earnings")
+                events.append(dict(isin=isin, date=StockDataDB.date_string(date), event_type="Earnings"))
 
         for key in calendar.keys():
             if key not in {'Dividend Date', 'Ex-Dividend Date', 'Earnings Date', 'Earnings High', 'Earnings Low',
                            'Earnings Average', 'Revenue High', 'Revenue Low', 'Revenue Average'}:
                 print(f"Unknown key in calendar: {key}")
 
-        database.connection.close()
+        return {
+            'metadata': dict(isin=isin,
+                             symbol=info['symbol'],
+                             name=info['shortName'],
+                             currency=info['currency'],
+                             exchange=info['exchange'],
+                             first_trade_date=StockDataDB.date_string(datetime.fromtimestamp(
+                                 info['firstTradeDateEpochUtc']))),
+            'absolutes': dict(isin=isin,
+                              date=date_string,
+                              market_cap=info.get('marketCap',None),
+                              enterprise_value=info.get('enterpriseValue',None),
+                              average_volume=info.get('averageVolume',None),
+                              average_volume_10days=info.get('averageVolume10days',None)),
+            'ratios': dict(isin=isin,
+                           date=date_string,
+                           beta=info.get('beta',None),
+                           trailing_pe=info.get('trailingPE',None),
+                           forward_pe=info.get('forwardPE',None),
+                           price_to_book=info.get('priceToBook',None),
+                           trailing_eps=info.get('trailingEps',None),
+                           forward_eps=info.get('forwardEps',None),
+                           enterprise_to_revenue=info.get('enterpriseToRevenue',None),
+                           enterprise_to_ebitda=info.get('enterpriseToEbitda',None)),
+            'events': events
+        }
+
+    @classmethod
+    def write_metadata(cls, database: StockDataDB, record: dict) -> int:
+        """Write a record from :meth:`fetch_metadata`, returns the number of rows written."""
+        database.add_metadata(**record['metadata'])
+        database.add_absolutes(**record['absolutes'])
+        database.add_ratios(**record['ratios'])
+        for event in record['events']:
+            database.add_event(**event)
+        return 3 + len(record['events'])
 
     @classmethod
     def _filtered_info(cls, ticker: yf.ticker.Ticker) -> dict:
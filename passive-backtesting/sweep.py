@@ -0,0 +1,226 @@
+import argparse
+import itertools
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from backtest import backtest, lump_sum, periodic
+from price_store import PricePanel, PriceStore
+from result_cache import ResultCache, data_fingerprint, data_source
+from total_return import TotalReturnStore
+
+DEFAULTS = {
+    'start': 0,
+    'horizon': None,
+    'contribution': "periodic",
+    'amount': 100.0,
+    'weighting': "equal",
+    'rebalance_every': 0,
+    'cost': 0.0,
+    'universe': None,
+    'field': "Close",
+    'periods_per_year': 12
+}
+'''simulation parameters a grid may vary, with the value used when it doesn't'''
+
+RESULTS = ("final_value", "invested", "costs", "cagr", "volatility", "sharpe", "max_drawdown")
+
+_panel: PricePanel | None = None
+_caps: np.ndarray | None = None
+_universes: dict[str, np.ndarray] = {}
+_listing_end: np.ndarray | None = None
+
+
+def expand_grid(grid: dict[str, list]) -> Iterator[dict]:
+    """Every combination of the values in ``grid``, lazily, with :data:`DEFAULTS` for the parameters it leaves out."""
+    unknown = set(grid) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+    keys = list(grid)
+    for values in itertools.product(*(grid[key] for key in keys)):
+        yield dict(DEFAULTS, **dict(zip(keys, values)))
+
+
+def _init_worker(store_directory: str, caps_path: str | None, universes: dict[str, list[str]], total_return: bool):
+    # Every worker maps the same files, so the OS shares their pages instead of each process holding a copy
+    global _panel, _caps, _universes, _listing_end
+    _panel = PriceStore(store_directory).load()
+    if total_return:
+        TotalReturnStore(PriceStore(store_directory)).attach(_panel)
+    _caps = np.load(caps_path, mmap_mode='r') if caps_path is not None else None
+    _listing_end = _panel.listing_range()[1]
+    stored = set(_panel.isins)
+    _universes = {name: np.array([_panel.column(isin) for isin in isins if isin in stored], dtype=np.intp)
+                  for name, isins in universes.items()}
+
+
+def _simulate(params: dict) -> tuple[float, ...]:
+    start = params['start']
+    stop = len(_panel.dates) if params['horizon'] is None else start + params['horizon']
+    columns = slice(None) if params['universe'] is None else _universes[params['universe']]
+    prices = _panel[params['field']][start:stop][:, columns]
+    caps = None if _caps is None else _caps[start:stop][:, columns]
+    n_periods = len(prices)
+    if n_periods == 0:
+        return (math.nan,) * len(RESULTS)
+    if params['contribution'] == "lump_sum":
+        contributions = lump_sum(n_periods, params['amount'])
+    elif params['contribution'] == "periodic":
+        contributions = periodic(n_periods, params['amount'])
+    else:
+        raise ValueError(f"Unknown contribution: {params['contribution']}")
+    # A window ending in a gap mustn't sell what the full panel still prices later
+    listing_end = _listing_end[columns] - start
+    result = backtest(prices, contributions, params['weighting'], params['rebalance_every'], params['cost'], caps,
+                      listing_end=listing_end)
+    # Risk metrics of the strategy itself, not of the contributions flowing in
+    unit_values = metrics.time_weighted(result.values, result.invested)
+    periods_per_year = params['periods_per_year']
+    return (result.final_value, result.total_invested, float(result.costs[-1]),
+            float(metrics.cagr(unit_values, periods_per_year)[0]),
+            float(metrics.volatility(unit_values, periods_per_year)[0]),
+            float(metrics.sharpe(unit_values, periods_per_year=periods_per_year)[0]),
+            float(metrics.max_drawdown(unit_values)[0]))
+
+
+def _run_chunk(chunk: list[tuple[int, dict]]) -> list[tuple]:
+    return [(run, *_simulate(params)) for run, params in chunk]
+
+
+class Sweep:
+    """
+    Runs a backtest for every combination of a parameter grid on a process pool. Workers read prices from the
+    memory-mapped :class:`PriceStore` rather than from pickled copies, at most ``max_in_flight`` chunks are queued at
+    once, and results stream back as compact DataFrames.
+    """
+
+    def __init__(self, store_directory: str, universes: dict[str, list[str]] | None = None,
+                 caps_path: str | None = None, processes: int | None = None, chunk_size: int = 64,
+                 max_in_flight: int | None = None, cache_directory: str | None = None,
+                 cache_bytes: int = 1 << 30):
+        """
+        :param store_directory: price store the simulations read their prices from, including its total return
+            index for grids that select it with ``'field': ["Total Return"]``
+        :param universes: named ISIN subsets a grid can select with its ``universe`` parameter
+        :param caps_path: ``.npy`` file with market caps aligned to the store, for market cap weighting
+        :param processes: worker processes, the CPU count when None
+        :param chunk_size: simulations sent to a worker at once
+        :param max_in_flight: chunks submitted but not yet collected, twice the number of processes when None
+        :param cache_directory: keep the results of every simulation in a :class:`ResultCache` here, so runs with
+            the same parameters on the same data aren't simulated again
+        :param cache_bytes: size the result cache is kept under
+        """
+        self.store_directory = store_directory
+        self.universes = universes or {}
+        self.caps_path = caps_path
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight or 2 * self.processes
+        self.cache_directory = cache_directory
+        self.cache_bytes = cache_bytes
+        self._universe_digests = {name: ResultCache.key({'isins': isins}) for name, isins in self.universes.items()}
+
+    def _cache_params(self, params: dict) -> dict:
+        # Universes by content rather than by name, and the result layout, which changes with the code
+        return dict(params, universe=self._universe_digests.get(params['universe']), results=RESULTS)
+
+    @classmethod
+    def _frame(cls, chunk: list[tuple[int, dict]], rows: list[tuple]) -> pd.DataFrame:
+        params = pd.DataFrame([params for _, params in chunk], index=[run for run, _ in chunk])
+        results = pd.DataFrame([row[1:] for row in rows], index=[row[0] for row in rows], columns=list(RESULTS))
+        return params.join(results).rename_axis("run")
+
+    def iter_results(self, grid: dict[str, list]) -> Iterator[pd.DataFrame]:
+        """Results of every simulation in ``grid``, one DataFrame per finished chunk, in completion order."""
+        total = math.prod(len(values) for values in grid.values())
+        runs = enumerate(expand_grid(grid))
+        done = 0
+        cache = None
+        if self.cache_directory is not None:
+            source = data_source(self.store_directory, self.caps_path)
+            fingerprint = data_fingerprint(self.store_directory, self.caps_path)
+            cache = ResultCache(self.cache_directory, source, fingerprint, self.cache_bytes)
+        # Only map the total return index when the grid reads it, and fail here rather than in every worker when
+        # it's missing or was built on another panel
+        total_return = TotalReturnStore.FIELD in grid.get('field', [DEFAULTS['field']])
+        if total_return:
+            store = PriceStore(self.store_directory)
+            TotalReturnStore(store).check(store.load())
+        start = last_report = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                 initargs=(self.store_directory, self.caps_path, self.universes,
+                                           total_return)) as executor:
+            pending = {}
+            # Chunks answered from the cache, with their rows, waiting to be yielded
+            cached: list[tuple[list, list]] = []
+
+            def submit_next() -> bool:
+                chunk = list(itertools.islice(runs, self.chunk_size))
+                if cache is not None:
+                    hits, misses = [], []
+                    for run, params in chunk:
+                        arrays = cache.get(self._cache_params(params))
+                        if arrays is None:
+                            misses.append((run, params))
+                        else:
+                            hits.append(((run, params), (run, *arrays['results'].tolist())))
+                    if hits:
+                        cached.append(([pair for pair, _ in hits], [row for _, row in hits]))
+                    if misses:
+                        pending[executor.submit(_run_chunk, misses)] = misses
+                elif chunk:
+                    pending[executor.submit(_run_chunk, chunk)] = chunk
+                return bool(chunk)
+
+            while len(pending) + len(cached) < self.max_in_flight and submit_next():
+                pass
+            while pending or cached:
+                if cached:
+                    chunk, rows = cached.pop(0)
+                    done += len(rows)
+                    yield self._frame(chunk, rows)
+                    submit_next()
+                else:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        chunk = pending.pop(future)
+                        rows = future.result()
+                        if cache is not None:
+                            for (_, params), row in zip(chunk, rows):
+                                cache.put(self._cache_params(params), {'results': np.array(row[1:])})
+                        done += len(rows)
+                        yield self._frame(chunk, rows)
+                        submit_next()
+                now = time.perf_counter()
+                if now - last_report >= 1 or not (pending or cached):
+                    hits = f", {cache.hits} from the cache" if cache is not None else ""
+                    print(f"Sweep: {done}/{total} simulations ({done / (now - start):.0f}/s{hits})")
+                    last_report = now
+
+    def run(self, grid: dict[str, list]) -> pd.DataFrame:
+        """All results of ``grid`` in one DataFrame, ordered by run."""
+        return pd.concat(list(self.iter_results(grid))).sort_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="How often does a lump sum beat monthly DCA of the same amount?")
+    parser.add_argument("--store", default="/home/ruben/Projects/finfacts/cache/panel-int_1mo")
+    parser.add_argument("--horizon", type=int, default=120, help="investment horizon in months")
+    parser.add_argument("--amount", type=float, default=100.0, help="monthly DCA amount")
+    parser.add_argument("--cache", help="directory to cache the simulation results in")
+    args = parser.parse_args()
+
+    sweep = Sweep(args.store, cache_directory=args.cache)
+    starts = list(range(max(len(PriceStore(args.store).load().dates) - args.horizon, 0)))
+    lump_sums = sweep.run({'start': starts, 'horizon': [args.horizon], 'contribution': ["lump_sum"],
+                           'amount': [args.amount * args.horizon]})
+    dca = sweep.run({'start': starts, 'horizon': [args.horizon], 'contribution': ["periodic"],
+                     'amount': [args.amount]})
+    wins = (lump_sums["final_value"].to_numpy() > dca["final_value"].to_numpy()).mean()
+    print(f"A lump sum beat monthly DCA for {wins:.0%} of the {len(starts)} start months")
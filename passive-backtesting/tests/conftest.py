@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are run as scripts from the package directory and import each other by their flat names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,65 @@
+import pytest
+
+from beursrally.assets import BeursrallyAssets
+
+STOCKS = BeursrallyAssets.STOCKS
+ETFS = BeursrallyAssets.ETFS
+
+
+def _asset(name: str, ticker: str) -> dict[str, str]:
+    return {"Name": name, "Ticker": ticker}
+
+
+@pytest.fixture
+def excluded(monkeypatch):
+    monkeypatch.setattr(BeursrallyAssets, "excluded_isins", {"BE0000000003"})
+
+
+def test_diff():
+    previous = {STOCKS: {"BE0000000001": _asset("One", "ONE"), "BE0000000002": _asset("Two", "TWO"),
+                         "BE0000000003": _asset("Three", "THR"), "BE0000000004": _asset("Four", "FOU")}}
+    current = {STOCKS: {"BE0000000001": _asset("One NV", "ONE"), "BE0000000002": _asset("Two", "TWO2"),
+                        "BE0000000005": _asset("Five", "FIV")},
+               ETFS: {"BE0000000004": _asset("Four", "FOU")}}
+
+    diff = BeursrallyAssets.diff(previous, current)
+
+    assert diff['classes'] == {
+        ETFS: {'added': ["BE0000000004"], 'removed': [], 'renamed': {}, 'reticked': {}},
+        STOCKS: {'added': ["BE0000000005"], 'removed': ["BE0000000003", "BE0000000004"],
+                 'renamed': {"BE0000000001": ["One", "One NV"]}, 'reticked': {"BE0000000002": ["TWO", "TWO2"]}}
+    }
+    # Moving to another asset class isn't leaving the universe
+    assert diff['delisted'] == ["BE0000000003"]
+    assert not diff['ingested']
+
+
+def test_merge_diffs():
+    first = {STOCKS: {"BE0000000001": _asset("One", "ONE"), "BE0000000002": _asset("Two", "TWO"),
+                      "BE0000000003": _asset("Three", "THR")}}
+    second = {STOCKS: {"BE0000000001": _asset("One NV", "ONE"), "BE0000000002": _asset("Two", "TWO2"),
+                       "BE0000000004": _asset("Four", "FOU")}}
+    third = {STOCKS: {"BE0000000001": _asset("One SA", "ONE"), "BE0000000002": _asset("Two", "TWO"),
+                      "BE0000000003": _asset("Three", "THR")}}
+
+    merged = BeursrallyAssets.merge_diffs(BeursrallyAssets.diff(first, second), BeursrallyAssets.diff(second, third))
+
+    assert merged['classes'][STOCKS] == {
+        # Removed and listed again, added and removed again
+        'added': ["BE0000000003"],
+        'removed': ["BE0000000004"],
+        'renamed': {"BE0000000001": ["One", "One SA"]},
+        # Re-ticked and back, so nothing changed
+        'reticked': {}
+    }
+    assert merged['delisted'] == ["BE0000000004"]
+    assert not merged['ingested']
+
+
+def test_changed_isins(excluded):
+    diff = {'classes': {STOCKS: {'added': ["BE0000000001", "BE0000000003"], 'removed': ["BE0000000005"],
+                                 'renamed': {"BE0000000002": ["Two", "Two NV"]},
+                                 'reticked': {"BE0000000004": ["FOU", "FOU2"]}}}}
+
+    assert BeursrallyAssets.changed_isins(diff, STOCKS) == ["BE0000000001", "BE0000000002", "BE0000000004"]
+    assert BeursrallyAssets.changed_isins(diff, ETFS) == []
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import backtest, backtest_streaming, lump_sum, periodic
+from price_store import PricePanel, PriceStore
+
+N_PERIODS = 60
+N_ASSETS = 20
+
+
+@pytest.fixture
+def store(tmp_path) -> PriceStore:
+    rng = np.random.default_rng(0)
+    close = 10 * np.exp(np.cumsum(rng.normal(0.005, 0.05, (N_PERIODS, N_ASSETS)), axis=0))
+    # Listings, delistings and gaps
+    close[:rng.integers(0, 20), 3] = np.nan
+    close[rng.integers(30, 50):, 7] = np.nan
+    close[rng.random(close.shape) < 0.05] = np.nan
+    dates = pd.date_range("2000-01-01", periods=N_PERIODS, freq="MS").to_numpy()
+    panel = PricePanel(dates, [f"XS{i:010d}" for i in range(N_ASSETS)], {'Close': close}, ~np.isnan(close))
+    store = PriceStore(str(tmp_path / "panel"))
+    store.save(panel)
+    return store
+
+
+@pytest.fixture
+def caps_path(tmp_path) -> str:
+    caps = np.random.default_rng(1).uniform(1e8, 1e11, (N_PERIODS, N_ASSETS))
+    path = str(tmp_path / "caps.npy")
+    np.save(path, caps)
+    return path
+
+
+# One row per chunk, a few rows, chunks that don't divide the periods, and everything in one chunk
+@pytest.mark.parametrize("chunk_rows", [1, 7, 25, N_PERIODS])
+@pytest.mark.parametrize("weighting", ["equal", "market_cap"])
+@pytest.mark.parametrize("rebalance_every", [0, 12])
+def test_streaming_matches_in_memory(store, caps_path, chunk_rows, weighting, rebalance_every):
+    contributions = periodic(N_PERIODS, 100.0)
+    caps = np.load(caps_path) if weighting == "market_cap" else None
+    # Chunks are sized at 4 float64 arrays per row and asset
+    memory_limit = chunk_rows * 4 * 8 * N_ASSETS
+    expected = backtest(store.load()["Close"], contributions, weighting, rebalance_every, 0.001, caps)
+    streamed = backtest_streaming(store, contributions, weighting, rebalance_every, 0.001,
+                                  caps_path if weighting == "market_cap" else None, memory_limit=memory_limit)
+
+    np.testing.assert_array_equal(streamed.values, expected.values)
+    np.testing.assert_array_equal(streamed.invested, expected.invested)
+    np.testing.assert_array_equal(streamed.costs, expected.costs)
+    np.testing.assert_array_equal(streamed.portfolio.shares, expected.portfolio.shares)
+
+
+def test_gap_keeps_position():
+    prices = np.array([[10, 10], [11, np.nan], [12, 20], [12, 40]], dtype=np.float64)
+    result = backtest(prices, lump_sum(4, 100.0))
+
+    np.testing.assert_allclose(result.portfolio.shares, [5, 5])
+    # Valued at its last price during the gap, and the doubling after it is kept
+    np.testing.assert_allclose(result.values, [100, 105, 160, 260])
+
+
+def test_delisting_sells_at_last_price():
+    prices = np.array([[10, 10], [11, 20], [12, np.nan], [12, np.nan]], dtype=np.float64)
+    result = backtest(prices, lump_sum(4, 100.0))
+
+    # The proceeds are reinvested in what is still listed
+    np.testing.assert_allclose(result.portfolio.shares, [5 + 100 / 12, 0])
+    np.testing.assert_allclose(result.values, [100, 155, 160, 160])
+
+
+def test_market_cap_without_caps_raises():
+    prices = np.full((4, 2), 10.0)
+    with pytest.raises(ValueError, match="No market caps"):
+        backtest(prices, periodic(4, 100.0), "market_cap", caps=np.full((4, 2), np.nan))
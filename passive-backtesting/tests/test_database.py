@@ -0,0 +1,169 @@
+import sqlite3
+
+import pytest
+
+from database import StockDataDB
+
+BASELINE_SCHEMA = '''
+    CREATE TABLE META (
+        isin TEXT NOT NULL PRIMARY KEY,
+        symbol TEXT NOT NULL,
+        name TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        exchange TEXT NOT NULL,
+        firstTradeDate TEXT NOT NULL
+    );
+    CREATE TABLE ABSOLUTES (
+        isin TEXT NOT NULL,
+        date TEXT NOT NULL,
+        marketCap INTEGER,
+        enterpriseValue INTEGER,
+        averageVolume INTEGER,
+        averageVolume10days INTEGER,
+        PRIMARY KEY (isin, date)
+    );
+    CREATE TABLE RATIOS (
+        isin TEXT NOT NULL,
+        date TEXT NOT NULL,
+        beta REAL,
+        trailingPE REAL,
+        forwardPE REAL,
+        priceToBook REAL,
+        trailingEps REAL,
+        forwardEps REAL,
+        enterpriseToRevenue REAL,
+        enterpriseToEbitda REAL,
+        PRIMARY KEY (isin, date)
+    );
+    CREATE TABLE EVENTS (
+        isin TEXT NOT NULL,
+        date TEXT NOT NULL,
+        eventType TEXT NOT NULL,
+        PRIMARY KEY (isin, date, eventType)
+    );'''
+
+
+@pytest.fixture
+def baseline_path(tmp_path) -> str:
+    """A database written by the original, string-formatted inserts: dd_mm_yyyy dates and 'NULL' as text."""
+    path = str(tmp_path / "baseline.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.executescript('''
+        INSERT INTO META VALUES ('BE0003470755', 'SOLB.BR', 'Solvay', 'EUR', 'BRU', '02_01_1990');
+        INSERT INTO ABSOLUTES VALUES ('BE0003470755', '28_02_2024', '3500000000', 'NULL', '250000', 'NULL');
+        INSERT INTO ABSOLUTES VALUES ('BE0003470755', '01_03_2024', '3600000000', '4000000000', '260000', '270000');
+        INSERT INTO RATIOS VALUES ('BE0003470755', '01_03_2024', '1.1', '12.5', 'NULL', '1.3', '4.2', 'NULL',
+                                   '0.9', '6.1');
+        INSERT INTO EVENTS VALUES ('BE0003470755', '15_05_2024', 'Dividend Date');
+        INSERT INTO EVENTS VALUES ('BE0003470755', '01_03_2023', 'Earnings Date');
+        INSERT INTO EVENTS VALUES ('BE0003470755', '20_12_2023', 'Ex-Dividend Date');''')
+    connection.commit()
+    connection.close()
+    return path
+
+
+def test_migrates_baseline_database(baseline_path):
+    database = StockDataDB(path=baseline_path)
+
+    assert database.cursor.execute("PRAGMA user_version").fetchone()[0] == StockDataDB.SCHEMA_VERSION
+    assert database.cursor.execute("SELECT firstTradeDate FROM META").fetchone()[0] == "1990-01-02"
+    # Ordered in SQL, which only works on the rewritten ISO dates
+    assert database.get_events_in_order() == [
+        ('BE0003470755', '2023-03-01', 'Earnings Date'),
+        ('BE0003470755', '2023-12-20', 'Ex-Dividend Date'),
+        ('BE0003470755', '2024-05-15', 'Dividend Date')
+    ]
+    assert database.get_absolutes("BE0003470755", "2024-02-29") == (
+        'BE0003470755', '2024-02-28', 3500000000, None, 250000, None)
+    assert database.get_absolutes("BE0003470755") == (
+        'BE0003470755', '2024-03-01', 3600000000, 4000000000, 260000, 270000)
+    assert database.get_ratios("BE0003470755") == (
+        'BE0003470755', '2024-03-01', 1.1, 12.5, None, 1.3, 4.2, None, 0.9, 6.1)
+    # Snapshots stored before the check dates existed count as checked on the day they were taken
+    assert database.get_latest_snapshot_dates() == {'BE0003470755': '2024-03-01'}
+    assert database.get_delisted() == {}
+    database.connection.close()
+
+
+def test_migration_runs_once(baseline_path):
+    StockDataDB(path=baseline_path).connection.close()
+    database = StockDataDB(path=baseline_path)
+    assert database.get_events_in_order("2024-01-01") == [('BE0003470755', '2024-05-15', 'Dividend Date')]
+    assert database.cursor.execute("SELECT COUNT(*) FROM ABSOLUTES").fetchone()[0] == 2
+    database.connection.close()
+
+
+ISINS = ["BE0003470755", "NL0010273215"]
+DAYS = [f"2024-03-{day:02d}" for day in range(1, 11)]
+
+
+def _snapshots() -> list[tuple[str, str, tuple, tuple]]:
+    """Daily snapshots that mostly repeat, with missing values and a value that changes and changes back."""
+    snapshots = []
+    for i, isin in enumerate(ISINS):
+        for day, date in enumerate(DAYS):
+            market_cap = 1000 + i if day < 4 else 1100 + i
+            average_volume = 50 if day in (6, 7) else 40
+            absolutes = (market_cap, None, average_volume, 30)
+            ratios = (1.1, 12.5 if day < 8 else 13.0, None, 1.3, 4.2, None, 0.9, 6.1)
+            snapshots.append((isin, date, absolutes, ratios))
+    return snapshots
+
+
+def _store(path: str, delta: bool) -> StockDataDB:
+    database = StockDataDB(path=path, delta=delta)
+    for isin, date, absolutes, ratios in _snapshots():
+        database.add_absolutes(isin, date, *absolutes)
+        database.add_ratios(isin, date, *ratios)
+    return database
+
+
+def _as_of_reads(database: StockDataDB) -> list:
+    """Every value an as-of read returns, per ISIN and per cross-section, without the snapshot dates."""
+    reads = []
+    for as_of in ["2024-02-29"] + DAYS + ["2024-12-31"]:
+        for isin in ISINS:
+            for snapshot in (database.get_absolutes(isin, as_of), database.get_ratios(isin, as_of)):
+                reads.append(None if snapshot is None else snapshot[:1] + snapshot[2:])
+        for cross_section in (database.get_absolutes_as_of(as_of), database.get_ratios_as_of(as_of)):
+            values = cross_section.drop(columns="date")
+            # NaN never equals NaN, None does
+            reads.append(values.astype(object).where(values.notna(), None).to_dict("index"))
+    return reads
+
+
+def _rows(database: StockDataDB, table: str) -> list[tuple]:
+    return database.cursor.execute(f"SELECT * FROM {table} ORDER BY isin, date").fetchall()
+
+
+def test_delta_storage_skips_unchanged_snapshots(tmp_path):
+    full = _store(str(tmp_path / "full.db"), delta=False)
+    delta = _store(str(tmp_path / "delta.db"), delta=True)
+
+    # Absolutes change on days 1, 5, 7 and 9, ratios on days 1 and 9
+    assert len(_rows(full, "ABSOLUTES")) == len(_rows(full, "RATIOS")) == len(ISINS) * len(DAYS)
+    assert len(_rows(delta, "ABSOLUTES")) == 4 * len(ISINS)
+    assert len(_rows(delta, "RATIOS")) == 2 * len(ISINS)
+    assert _as_of_reads(delta) == _as_of_reads(full)
+    # Skipped snapshots still count as checked
+    assert delta.get_latest_snapshot_dates() == full.get_latest_snapshot_dates() == {isin: DAYS[-1] for isin in ISINS}
+    full.connection.close()
+    delta.connection.close()
+
+
+def test_compaction_keeps_as_of_reads(tmp_path):
+    full = _store(str(tmp_path / "full.db"), delta=False)
+    delta = _store(str(tmp_path / "delta.db"), delta=True)
+    reads = _as_of_reads(full)
+
+    deleted = full.compact_snapshots()
+
+    assert deleted == {'ABSOLUTES': (len(DAYS) - 4) * len(ISINS), 'RATIOS': (len(DAYS) - 2) * len(ISINS)}
+    assert _as_of_reads(full) == reads
+    # Compacted daily snapshots are exactly what delta storage would have kept
+    for table in ("ABSOLUTES", "RATIOS"):
+        assert _rows(full, table) == _rows(delta, table)
+    assert full.compact_snapshots() == {'ABSOLUTES': 0, 'RATIOS': 0}
+    full.connection.close()
+    delta.connection.close()
@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+import history
+from data_source import SyntheticDataSource
+
+ISIN = "XS0000000000"
+
+
+class _WithoutStart(SyntheticDataSource):
+    """A source that no longer returns the candle at ``start``, e.g. because it was stored after it closed."""
+
+    def history(self, isin: str, period: str | None = None, start: str | None = None,
+                interval: str = "1mo") -> pd.DataFrame:
+        candles = super().history(isin, period, start, interval)
+        return candles[candles.index.strftime("%Y-%m-%d") > start] if start is not None else candles
+
+
+@pytest.fixture(autouse=True)
+def cache_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "CACHE_PATH", str(tmp_path) + "/")
+
+
+def _stored() -> pd.DataFrame:
+    return pd.read_csv(history.candles_path(ISIN), index_col="Date", parse_dates=True)
+
+
+def test_update_replaces_the_last_candle():
+    assert history.save_candles(ISIN, source=SyntheticDataSource(end_date="2025-06-15"))
+    stored = _stored()
+    later = SyntheticDataSource(end_date="2025-12-31")
+
+    assert history.update_candles(ISIN, source=later)
+
+    updated = _stored()
+    expected = later.history(ISIN, period="max")
+    assert list(updated.index) == list(expected.index)
+    # The candles before the last stored one are kept, the last one and those after it are the fresh ones
+    pd.testing.assert_frame_equal(updated.iloc[:len(stored) - 1], stored.iloc[:-1])
+    pd.testing.assert_frame_equal(updated.iloc[len(stored) - 1:], expected.iloc[len(stored) - 1:],
+                                  check_freq=False, check_names=False)
+
+
+def test_update_appends_after_the_last_candle():
+    assert history.save_candles(ISIN, source=SyntheticDataSource(end_date="2025-06-15"))
+    stored = _stored()
+    # Without a newline after the last candle, the new ones still go on lines of their own
+    path = history.candles_path(ISIN)
+    with open(path) as file:
+        content = file.read()
+    with open(path, 'w') as file:
+        file.write(content.rstrip("\n"))
+    later = _WithoutStart(end_date="2025-12-31")
+
+    assert history.update_candles(ISIN, source=later)
+
+    updated = _stored()
+    expected = later.history(ISIN, start="2025-06-01")
+    assert list(updated.index) == list(stored.index) + list(expected.index)
+    pd.testing.assert_frame_equal(updated.iloc[:len(stored)], stored)
+    pd.testing.assert_frame_equal(updated.iloc[len(stored):], expected, check_freq=False, check_names=False)
+
+
+def test_update_of_header_only_file_stores_full_history():
+    source = SyntheticDataSource(end_date="2025-12-31")
+    with open(history.candles_path(ISIN), 'w') as file:
+        file.write("Date,Open,High,Low,Close,Volume,Dividends,Stock Splits\n")
+
+    assert history.update_candles(ISIN, source=source)
+
+    pd.testing.assert_frame_equal(_stored(), source.history(ISIN, period="max"), check_freq=False,
+                                  check_names=False)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import metrics
+
+N_PERIODS = 48
+N_SERIES = 8
+WINDOW = 12
+
+
+@pytest.fixture
+def values() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    values = 10 * np.exp(np.cumsum(rng.normal(0.005, 0.05, (N_PERIODS, N_SERIES)), axis=0))
+    # Late listings, a delisting, gaps, a single value and a series without any
+    values[:10, 1] = np.nan
+    values[:40, 2] = np.nan
+    values[30:, 3] = np.nan
+    values[rng.random(values.shape) < 0.1] = np.nan
+    values[:, 4] = np.nan
+    values[20, 4] = 12.0
+    values[:, 5] = np.nan
+    return values
+
+
+def test_running_metrics_match_batch(values):
+    running = metrics.RunningMetrics(N_SERIES, risk_free=0.02, periods_per_year=12, window=WINDOW)
+    rolling = metrics.rolling_returns(values, WINDOW)
+
+    for period, row in enumerate(values):
+        running.update(row)
+        seen = values[:period + 1]
+        np.testing.assert_allclose(running.cagr(), metrics.cagr(seen, 12))
+        np.testing.assert_allclose(running.volatility(), metrics.volatility(seen, 12))
+        np.testing.assert_allclose(running.sharpe(), metrics.sharpe(seen, 0.02, 12))
+        np.testing.assert_allclose(running.sortino(), metrics.sortino(seen, 0.02, 12))
+        np.testing.assert_allclose(running.max_drawdown, metrics.max_drawdown(seen))
+        np.testing.assert_array_equal(running.drawdown_duration, metrics.drawdown_duration(seen))
+        np.testing.assert_allclose(running.rolling_return(), rolling[period])
+
+
+def test_extend_matches_update(values):
+    extended = metrics.RunningMetrics(N_SERIES)
+    extended.extend(values)
+    updated = metrics.RunningMetrics(N_SERIES)
+    for row in values:
+        updated.update(row)
+
+    np.testing.assert_array_equal(extended.sharpe(), updated.sharpe())
+    np.testing.assert_array_equal(extended.drawdown_duration, updated.drawdown_duration)
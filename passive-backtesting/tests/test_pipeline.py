@@ -0,0 +1,102 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from data_source import SyntheticDataSource
+from database import StockDataDB
+from instrumentation import Instrumentation
+from pipeline import MetadataPipeline
+from refresh import CheckpointJournal, RefreshPlanner
+from stock_metadata import StockMetadata
+
+N_ISINS = 20
+
+
+class _Unnamed(SyntheticDataSource):
+    """Leaves out the short name of every ``every``-th ISIN."""
+
+    def __init__(self, every: int, **kwargs):
+        super().__init__(**kwargs)
+        self.every = every
+
+    def info(self, isin: str) -> dict:
+        info = super().info(isin)
+        if int(isin[-8:]) % self.every == 0:
+            info['shortName'] = None
+        return info
+
+
+class _Unchecked(StockMetadata):
+    """Passes records without the required info on, so the database rejects them."""
+
+    REQUIRED_INFO = ()
+
+
+def _run(tmp_path, stock_metadata: StockMetadata, **kwargs) -> tuple[MetadataPipeline, dict, CheckpointJournal]:
+    journal = CheckpointJournal(str(tmp_path / "journal"), datetime.today())
+    pipeline = MetadataPipeline(stock_metadata, str(tmp_path / "finfacts.db"), concurrency=4, journal=journal,
+                                report=False, **kwargs)
+    isins = stock_metadata.data_source.isins()
+    summary = {}
+    # A hanging writer fails the test instead of the whole run
+    runner = threading.Thread(target=lambda: summary.update(pipeline.run(isins)), daemon=True)
+    runner.start()
+    runner.join(timeout=60)
+    assert not runner.is_alive(), "the pipeline hangs"
+    return pipeline, summary, journal
+
+
+def _planned(tmp_path, isins: list[str]) -> list[str]:
+    database = StockDataDB(path=str(tmp_path / "finfacts.db"))
+    journal = CheckpointJournal(str(tmp_path / "journal"), datetime.today())
+    return RefreshPlanner(database, journal=journal).plan(isins)
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 5000])
+def test_run_stores_and_checkpoints_every_isin(tmp_path, batch_size):
+    source = SyntheticDataSource(N_ISINS)
+    pipeline, summary, journal = _run(tmp_path, StockMetadata(data_source=source, instrumentation=Instrumentation()),
+                                      batch_size=batch_size)
+
+    assert summary['stored'] == N_ISINS and summary['failed'] == 0
+    assert journal.done() == set(source.isins())
+    assert StockDataDB(path=str(tmp_path / "finfacts.db")).get_currencies().keys() == set(source.isins())
+    assert _planned(tmp_path, source.isins()) == []
+
+
+def test_fetch_failures_are_resumed(tmp_path):
+    source = _Unnamed(5, n_isins=N_ISINS)
+    unnamed = [isin for isin in source.isins() if int(isin[-8:]) % 5 == 0]
+    pipeline, summary, journal = _run(tmp_path, StockMetadata(data_source=source, instrumentation=Instrumentation()))
+
+    assert summary['stored'] == N_ISINS - len(unnamed) and summary['failed'] == len(unnamed)
+    assert set(pipeline.failures) == set(unnamed)
+    assert journal.done() == set(source.isins()) - set(unnamed)
+    assert _planned(tmp_path, source.isins()) == unnamed
+
+
+def test_rejected_records_are_failures(tmp_path):
+    source = _Unnamed(5, n_isins=N_ISINS)
+    unnamed = [isin for isin in source.isins() if int(isin[-8:]) % 5 == 0]
+    pipeline, summary, journal = _run(tmp_path, _Unchecked(data_source=source, instrumentation=Instrumentation()),
+                                      batch_size=7)
+
+    assert summary['stored'] == N_ISINS - len(unnamed) and summary['failed'] == len(unnamed)
+    assert pipeline.failures == {isin: "rows rejected by the database" for isin in unnamed}
+    assert journal.done() == set(source.isins()) - set(unnamed)
+    # Their snapshots were stored, their metadata wasn't
+    assert _planned(tmp_path, source.isins()) == unnamed
+
+
+def test_failing_writer_doesnt_hang(tmp_path, monkeypatch):
+    def flush(database):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(StockDataDB, "flush", flush)
+    source = SyntheticDataSource(N_ISINS)
+    pipeline, summary, journal = _run(tmp_path, StockMetadata(data_source=source, instrumentation=Instrumentation()),
+                                      batch_size=7, queue_size=2)
+
+    assert summary['stored'] == 0 and summary['failed'] == N_ISINS
+    assert journal.done() == set()
@@ -0,0 +1,50 @@
+from database import StockDataDB
+from refresh import CheckpointJournal, RefreshPlanner
+
+ISINS = ["BE0000000001", "BE0000000002", "BE0000000003", "BE0000000004"]
+
+
+def _snapshot(database: StockDataDB, isin: str, date: str):
+    database.add_metadata(isin, f"S{isin[-4:]}", f"Stock {isin}", "EUR", "BRU", "2000-01-03")
+    database.add_absolutes(isin, date, 10 ** 9, 10 ** 9, 10 ** 5, 10 ** 5)
+    database.add_ratios(isin, date, 1.0, 15.0, 14.0, 2.0, 3.0, 3.5, 1.5, 8.0)
+
+
+def test_journal_resumes_done_isins(tmp_path):
+    path = str(tmp_path / "journal")
+    journal = CheckpointJournal(path, "2025-06-02")
+    journal.mark_done(ISINS[:2])
+    journal.mark_failed(ISINS[2], "ValueError('No shortName')")
+
+    # Failed ISINs are tried again
+    assert CheckpointJournal(path, "2025-06-02").done() == set(ISINS[:2])
+
+
+def test_journal_of_another_target_date_starts_over(tmp_path):
+    path = str(tmp_path / "journal")
+    CheckpointJournal(path, "2025-06-02").mark_done(ISINS[:2])
+
+    journal = CheckpointJournal(path, "2025-06-03")
+
+    assert journal.done() == set()
+    with open(path) as file:
+        assert file.read() == "target 2025-06-03\n"
+
+
+def test_plan_skips_fresh_and_done_isins(tmp_path):
+    database = StockDataDB(path=str(tmp_path / "finfacts.db"))
+    _snapshot(database, ISINS[0], "2025-06-02")
+    _snapshot(database, ISINS[1], "2025-05-30")
+    journal = CheckpointJournal(str(tmp_path / "journal"), "2025-06-02")
+    journal.mark_done([ISINS[2]])
+
+    assert RefreshPlanner(database).plan(ISINS, "2025-06-02") == ISINS[1:]
+    assert RefreshPlanner(database, max_age_days=3, journal=journal).plan(ISINS, "2025-06-02") == ISINS[3:]
+
+
+def test_plan_counts_isins_without_metadata_as_missing(tmp_path):
+    database = StockDataDB(path=str(tmp_path / "finfacts.db"))
+    database.add_absolutes(ISINS[0], "2025-06-02", 10 ** 9, 10 ** 9, 10 ** 5, 10 ** 5)
+    database.add_ratios(ISINS[0], "2025-06-02", 1.0, 15.0, 14.0, 2.0, 3.0, 3.5, 1.5, 8.0)
+
+    assert RefreshPlanner(database).plan(ISINS[:1], "2025-06-02") == ISINS[:1]
@@ -0,0 +1,25 @@
+import numpy as np
+
+from result_cache import ResultCache
+
+PARAMS = {'start': 0, 'horizon': 120, 'weighting': "equal"}
+
+
+def test_new_fingerprint_replaces_old_one(tmp_path):
+    cache = ResultCache(str(tmp_path), "source", "A")
+    cache.put(PARAMS, {'values': np.arange(3.0)})
+
+    assert ResultCache(str(tmp_path), "source", "B").get(PARAMS) is None
+    assert ResultCache.fingerprint_directories(str(tmp_path), "source") == ["B"]
+    assert ResultCache(str(tmp_path), "source", "A").get(PARAMS) is None
+
+
+def test_sources_sharing_a_directory_keep_their_results(tmp_path):
+    cache = ResultCache(str(tmp_path), "first", "A")
+    cache.put(PARAMS, {'values': np.arange(3.0)})
+
+    ResultCache(str(tmp_path), "second", "B")
+    entry = ResultCache(str(tmp_path), "first", "A").get(PARAMS)
+
+    np.testing.assert_array_equal(entry['values'], np.arange(3.0))
+    assert ResultCache.sources(str(tmp_path)) == ["first", "second"]
@@ -0,0 +1,146 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from metrics import previous_valid
+from price_store import PricePanel, PriceStore
+
+PRICES = ("auto_adjusted", "split_adjusted", "raw")
+'''what the Close prices of a panel already account for: yfinance's default ``auto_adjust=True`` history has
+dividends and splits folded into Close, ``auto_adjust=False`` history is only adjusted for splits, and raw exchange
+prices for neither'''
+
+
+def total_return_index(close: np.ndarray, dividends: np.ndarray, splits: np.ndarray,
+                       prices: str = "auto_adjusted") -> np.ndarray:
+    """
+    Dividend-reinvested total return index of every column of the ``dates x isins`` arrays, 1.0 at the first valid
+    candle of each ISIN and NaN where it has no candle. Each candle grows the index by
+    ``(close + dividends) * split / previous close``, with the terms ``prices`` says Close doesn't include yet.
+    Gaps are bridged from the last valid close.
+    """
+    if prices not in PRICES:
+        raise ValueError(f"Unknown prices: {prices}")
+    close = np.asarray(close, dtype=np.float64)
+    valid = ~np.isnan(close)
+    previous_close = previous_valid(close)
+
+    growth = close
+    if prices != "auto_adjusted":
+        growth = growth + np.nan_to_num(np.asarray(dividends, dtype=np.float64))
+    if prices == "raw":
+        # yfinance reports the split ratio on the split date and 0 on other dates
+        splits = np.nan_to_num(np.asarray(splits, dtype=np.float64))
+        growth = growth * np.where(splits > 0, splits, 1.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = np.where(valid & ~np.isnan(previous_close), growth / previous_close, 1.0)
+    index = np.cumprod(growth, axis=0)
+    index[~valid] = np.nan
+    return index
+
+
+class TotalReturnStore:
+    """
+    Total return index of a :class:`PriceStore`, kept in the same directory and aligned with its panel. Rebuilds
+    only recompute the ISINs whose candles changed, detected with a hash of every ISIN's candles, and
+    :meth:`load` memory-maps the result so simulations read it like any other field.
+    """
+
+    FIELD = "Total Return"
+    '''name the index gets among the fields of a panel, see :meth:`attach`'''
+
+    def __init__(self, store: PriceStore):
+        self.store = store
+        self.directory = store.directory
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def exists(self) -> bool:
+        return os.path.exists(self._path("total_return.json"))
+
+    @classmethod
+    def _hashes(cls, panel: PricePanel, prices: str) -> list[str]:
+        # Only the rows from the first to the last candle count, so rows appended after a delisting change nothing
+        first, last = panel.listing_range()
+        fields = [panel[field] for field in ("Close", "Dividends", "Stock Splits") if field in panel.fields]
+        hashes = []
+        for column, rows in enumerate(map(slice, first, last)):
+            digest = hashlib.blake2b(prices.encode(), digest_size=16)
+            digest.update(panel.dates[rows].tobytes())
+            for field in fields:
+                digest.update(np.ascontiguousarray(field[rows, column]).tobytes())
+            hashes.append(digest.hexdigest())
+        return hashes
+
+    def build(self, panel: PricePanel | None = None, prices: str = "auto_adjusted") -> np.ndarray:
+        """
+        Bring the stored index up to date with ``panel`` (the stored panel when None) and return it. Columns of
+        unchanged ISINs are copied from the previous build, as long as its dates are all still on the panel's axis.
+        """
+        panel = panel if panel is not None else self.store.load()
+        hashes = self._hashes(panel, prices)
+        index = np.full(panel.shape, np.nan)
+        changed = np.ones(len(panel.isins), dtype=bool)
+
+        if self.exists():
+            with open(self._path("total_return.json"), 'r') as file:
+                manifest = json.load(file)
+            old_dates = np.load(self._path("total_return_dates.npy"))
+            if np.isin(old_dates, panel.dates).all():
+                rows = np.searchsorted(panel.dates, old_dates)
+                old_columns = {isin: column for column, isin in enumerate(manifest['isins'])}
+                reused = [(column, old_columns[isin]) for column, isin in enumerate(panel.isins)
+                          if manifest['hashes'].get(isin) == hashes[column]]
+                if reused:
+                    new, old = (np.array(columns, dtype=np.intp) for columns in zip(*reused))
+                    index[np.ix_(rows, new)] = np.load(self._path("total_return.npy"), mmap_mode='r')[:, old]
+                    changed[new] = False
+
+        columns = np.flatnonzero(changed)
+        if len(columns):
+            splits = panel["Stock Splits"][:, columns] if "Stock Splits" in panel.fields else np.zeros(1)
+            dividends = panel["Dividends"][:, columns] if "Dividends" in panel.fields else np.zeros(1)
+            index[:, columns] = total_return_index(panel["Close"][:, columns], dividends, splits, prices)
+
+        self.store.save_array("total_return", index)
+        self.store.save_array("total_return_dates", panel.dates)
+        with open(self._path("total_return.json.tmp"), 'w') as file:
+            # noinspection PyTypeChecker
+            json.dump({'isins': panel.isins, 'prices': prices, 'hashes': dict(zip(panel.isins, hashes))}, file,
+                      indent=4)
+        os.replace(self._path("total_return.json.tmp"), self._path("total_return.json"))
+        print(f"Rebuilt the total return index of {len(columns)}/{len(panel.isins)} ISINs in {self.directory}")
+        return index
+
+    def load(self, mmap_mode: str | None = 'r') -> np.ndarray:
+        """The stored ``dates x isins`` index, memory-mapped read-only by default."""
+        return np.load(self._path("total_return.npy"), mmap_mode=mmap_mode)
+
+    def check(self, panel: PricePanel):
+        """Raise a ValueError unless an index is stored and was built on ``panel``."""
+        if not self.exists():
+            raise ValueError(f"There is no total return index in {self.directory}, build it first")
+        with open(self._path("total_return.json"), 'r') as file:
+            isins = json.load(file)['isins']
+        if isins != panel.isins or not np.array_equal(np.load(self._path("total_return_dates.npy")), panel.dates):
+            raise ValueError(f"The total return index in {self.directory} was built on another panel, rebuild it")
+
+    def attach(self, panel: PricePanel) -> PricePanel:
+        """Add the stored index to ``panel`` as the :data:`FIELD` field, the panel must be the one it was built on."""
+        self.check(panel)
+        index = self.load()
+        panel.fields[self.FIELD] = index
+        return panel
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the total return index next to a price store")
+    parser.add_argument("--store", default="/home/ruben/Projects/finfacts/cache/panel-int_1mo")
+    parser.add_argument("--prices", choices=PRICES, default="auto_adjusted",
+                        help="what the stored Close prices already include, auto_adjusted for history.py candles")
+    args = parser.parse_args()
+    TotalReturnStore(PriceStore(args.store)).build(prices=args.prices)